@@ -0,0 +1,195 @@
+"""
+Benchmarks of the vb_django.app computations on synthetic data.
+Usage: python -m vb_django.app.benchmarks [benchmark name ...]
+"""
+from vb_django.app.statistics import DatasetStatistics
+from vb_django.app.preprocessing import PPGraph, DAGKernels
+from vb_django.app.vb_helper import ShrinkBigKTransformer, lars_path_cache, gram_cache
+from vb_django.app.linear_regression import LinearRegressionAutomatedVB
+from vb_django.app.model_artifact import ModelArtifact
+from vb_django.app.flat_model import FlatLinearModel
+import numpy as np
+import pandas as pd
+import pickle
+import copy
+import time
+import sys
+
+
+def timed(f, repeat=3):
+    """
+    :param f: Function to time
+    :param repeat: Number of executions
+    :return: Best wall time of the executions in seconds
+    """
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+
+def random_dataset(rows, columns, seed=42):
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame(rng.normal(size=(rows, columns)), columns=["x{}".format(i) for i in range(columns)])
+    df["Response"] = df.iloc[:, :min(columns, 5)].sum(axis=1) + rng.normal(size=rows)
+    return df
+
+
+def benchmark_statistics(rows=1000, columns=(100, 500, 1000, 2000)):
+    print("DatasetStatistics.calculate_statistics, {} rows".format(rows))
+    print("{:>8} {:>12} {:>12} {:>8}".format("columns", "per column", "vectorized", "speedup"))
+    for k in columns:
+        df = random_dataset(rows, k)
+        t_loop = timed(lambda: DatasetStatistics(df).calculate_statistics_per_column("Response"), repeat=1)
+        t_vec = timed(lambda: DatasetStatistics(df).calculate_statistics("Response"))
+        print("{:>8} {:>11.3f}s {:>11.3f}s {:>7.1f}x".format(k, t_loop, t_vec, t_loop / t_vec))
+
+
+def benchmark_parallel_statistics(rows=5000, columns=(512, 1024, 2048), workers=4):
+    print("DatasetStatistics.calculate_statistics parallel column blocks, {} rows, {} workers".format(rows, workers))
+    print("{:>8} {:>12} {:>12} {:>8}".format("columns", "sequential", "parallel", "speedup"))
+    for k in columns:
+        df = random_dataset(rows, k)
+        t_seq = timed(lambda: DatasetStatistics(df).calculate_statistics("Response", parallel=False))
+        t_par = timed(lambda: DatasetStatistics(df, workers=workers).calculate_statistics("Response", parallel=True))
+        print("{:>8} {:>11.3f}s {:>11.3f}s {:>7.1f}x".format(k, t_seq, t_par, t_seq / t_par))
+
+
+def random_pp_config(columns, nodes, seed=42):
+    """
+    Pre-processing configuration of random add/subtract/square/normalize operations on the dataset columns and on
+    earlier node outputs, with an edge from each producing node to its consumers.
+    """
+    rng = np.random.RandomState(seed)
+    available = [("x{}".format(i), None) for i in range(columns)]
+    config = {"nodes": {}, "edges": []}
+    node = 0
+    while node < nodes:
+        function = ["add", "subtract", "square", "normalize"][rng.randint(4)]
+        inputs, output_format = DAGKernels.signatures[function]
+        picks = [available[rng.randint(len(available))] for i in inputs]
+        args = {a: c for a, (c, _) in zip(inputs, picks)}
+        if output_format.format(**args) in [c for c, _ in available]:
+            continue
+        node += 1
+        config["nodes"][node] = {"function": function, "args": args}
+        config["edges"].extend([[producer, node] for _, producer in picks if producer is not None])
+        available.append((output_format.format(**args), node))
+    return config
+
+
+def benchmark_ppgraph(rows=20000, columns=50, nodes=(10, 25, 50, 100, 200)):
+    print("PPGraph execution, {} rows x {} columns".format(rows, columns))
+    print("{:>8} {:>12} {:>12} {:>8}".format("nodes", "traverse", "compiled", "speedup"))
+    df = random_dataset(rows, columns)
+    for k in nodes:
+        config = random_pp_config(columns, k)
+        t_traverse = timed(lambda: PPGraph(df, copy.deepcopy(config), compiled=False))
+        t_compiled = timed(lambda: PPGraph(df, copy.deepcopy(config)))
+        print("{:>8} {:>11.3f}s {:>11.3f}s {:>7.1f}x".format(k, t_traverse, t_compiled, t_traverse / t_compiled))
+
+
+def benchmark_fused_chains(rows=1000000, lengths=(2, 3, 5, 8)):
+    print("PPGraph chains of elementwise operations, {} rows".format(rows))
+    print("{:>8} {:>12} {:>12} {:>8}".format("length", "per step", "fused", "speedup"))
+    df = random_dataset(rows, 2).abs()
+    for k in lengths:
+        config = {"nodes": {1: {"function": "add", "args": {"c1": "x0", "c2": "x1"}}}, "edges": []}
+        column = "x0+x1"
+        for node in range(2, k + 1):
+            function = ["square", "log", "subtract"][node % 3]
+            args = {"c1": column, "c2": "x1"} if function == "subtract" else {"c": column}
+            config["nodes"][node] = {"function": function, "args": args}
+            config["edges"].append([node - 1, node])
+            column = DAGKernels.signatures[function][1].format(**args)
+        graph = PPGraph(None, config, outputs=[column])
+        steps, fused = graph.compile([column], fuse=False), graph.plan
+        t_steps = timed(lambda: steps.execute(df, workers=1))
+        t_fused = timed(lambda: fused.execute(df, workers=1))
+        print("{:>8} {:>11.3f}s {:>11.3f}s {:>7.1f}x".format(k, t_steps, t_fused, t_steps / t_fused))
+
+
+def benchmark_lars_selection(rows=2000, columns=(50, 100, 200)):
+    print("ShrinkBigKTransformer fits over the max_k grid, {} rows".format(rows))
+    print("{:>8} {:>12} {:>12} {:>8}".format("columns", "Lars", "lars-path", "speedup"))
+    for k in columns:
+        df = random_dataset(rows, k)
+        x, y = df.drop("Response", axis=1).to_numpy(), df["Response"].to_numpy()
+        grid = np.arange(4, k, 4)
+
+        def fit(selector):
+            lars_path_cache.clear()
+            for max_k in grid:
+                ShrinkBigKTransformer(max_k=max_k, selector=selector).fit(x, y)
+        t_lars = timed(lambda: fit('Lars'), repeat=1)
+        t_path = timed(lambda: fit('lars-path'))
+        print("{:>8} {:>11.3f}s {:>11.3f}s {:>7.1f}x".format(k, t_lars, t_path, t_lars / t_path))
+
+
+def benchmark_gram_selection(rows=(20000, 100000), columns=100):
+    print("ShrinkBigKTransformer elastic-net selection of two targets on the same fold data, {} columns".format(columns))
+    print("{:>8} {:>12} {:>12} {:>8}".format("rows", "ElasticNetCV", "Gram", "speedup"))
+    for n in rows:
+        df = random_dataset(n, columns)
+        x, y = df.drop("Response", axis=1).to_numpy(), df["Response"].to_numpy()
+        targets = [y, np.log1p(y - y.min())]
+
+        def fit(selector):
+            gram_cache.clear()
+            for target in targets:
+                ShrinkBigKTransformer(selector=selector).fit(x, target)
+        t_enet = timed(lambda: fit('elastic-net'), repeat=1)
+        t_gram = timed(lambda: fit('elastic-net-gram'), repeat=1)
+        print("{:>8} {:>11.3f}s {:>11.3f}s {:>7.1f}x".format(n, t_enet, t_gram, t_enet / t_gram))
+
+
+def benchmark_model_artifact(rows=2000, columns=(12, 24, 48)):
+    print("Stored fitted automated regressor, {} rows".format(rows))
+    print("{:>8} {:>12} {:>12} {:>12} {:>12} {:>8}".format("columns", "pickle", "artifact", "pickle load",
+                                                           "artifact load", "speedup"))
+    for k in columns:
+        df = random_dataset(rows, k)
+        t = LinearRegressionAutomatedVB(n_jobs=1)
+        t.set_data(df.drop("Response", axis=1), df["Response"])
+        t.set_pipeline()
+        blob, artifact = pickle.dumps(t.lr_estimator), ModelArtifact.dumps(t.lr_estimator)
+        t_pickle = timed(lambda: pickle.loads(blob), repeat=20)
+        t_artifact = timed(lambda: ModelArtifact.loads(artifact), repeat=20)
+        print("{:>8} {:>11}B {:>11}B {:>11.5f}s {:>11.5f}s {:>7.1f}x".format(
+            k, len(blob), len(artifact), t_pickle, t_artifact, t_pickle / t_artifact))
+
+
+def benchmark_flat_model(rows=(100, 10000, 1000000), columns=24):
+    print("Predictions of a fitted automated regressor, {} columns".format(columns))
+    print("{:>8} {:>12} {:>12} {:>8}".format("rows", "pipeline", "flat", "speedup"))
+    df = random_dataset(2000, columns)
+    t = LinearRegressionAutomatedVB(n_jobs=1)
+    t.set_data(df.drop("Response", axis=1), df["Response"])
+    t.set_pipeline()
+    pipeline = ModelArtifact.compact(t.lr_estimator)
+    flat = FlatLinearModel.export(pipeline, list(t.x_train.columns))
+    for n in rows:
+        x = random_dataset(n, columns, seed=n).drop("Response", axis=1)
+        t_pipeline = timed(lambda: pipeline.predict(x))
+        t_flat = timed(lambda: flat.predict(x))
+        print("{:>8} {:>11.5f}s {:>11.5f}s {:>7.1f}x".format(n, t_pipeline, t_flat, t_pipeline / t_flat))
+
+
+benchmarks = {
+    "statistics": benchmark_statistics,
+    "parallel_statistics": benchmark_parallel_statistics,
+    "ppgraph": benchmark_ppgraph,
+    "fused_chains": benchmark_fused_chains,
+    "lars_selection": benchmark_lars_selection,
+    "gram_selection": benchmark_gram_selection,
+    "model_artifact": benchmark_model_artifact,
+    "flat_model": benchmark_flat_model
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or benchmarks.keys():
+        benchmarks[name]()
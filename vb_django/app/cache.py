@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache, bounded by the total estimated size of the cached values and optionally by
+    the number of entries. Tracks hit, miss and eviction counts.
+    """
+    def __init__(self, max_size, max_entries=None, sizeof=None):
+        """
+        :param max_size: Maximum total size of the cached values, in the units returned by sizeof
+        :param max_entries: Optional maximum number of cached entries
+        :param sizeof: Function returning the estimated size of a value, defaults to 1 per entry
+        """
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.sizeof = sizeof if sizeof else (lambda v: 1)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.max_size:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size or (self.max_entries and len(self.entries) > self.max_entries):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, match):
+        """
+        Remove all entries whose key matches.
+        :param match: Function taking a key and returning True if the entry should be removed
+        :return: Number of removed entries
+        """
+        with self.lock:
+            keys = [k for k in self.entries.keys() if match(k)]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _remove(self, key):
+        value, size = self.entries.pop(key)
+        self.size -= size
@@ -0,0 +1,274 @@
+from vb_django.app.cache import LRUCache
+from dask import delayed
+from io import StringIO
+import dask.dataframe as dd
+import pyarrow as pa
+import pandas as pd
+import hashlib
+import zlib
+import os
+
+
+# Per process cache of parsed datasets, keyed by (dataset id, content hash)
+dataset_cache = LRUCache(
+    max_size=int(os.getenv("VB_DATASET_CACHE_MB", 256)) * 1024 * 1024,
+    sizeof=lambda df: int(df.memory_usage(index=True, deep=True).sum())
+)
+
+
+class DatasetLoader:
+    """
+    Storage format and loading of Dataset.data. Uploaded csv data is parsed once and stored as an Arrow IPC file,
+    with the zlib compressed original csv in the schema metadata, datasets saved before the columnar format are still
+    read as csv.
+    """
+    magic = b"ARROW1"
+    batch_size = 65536
+    # schema metadata key of the compressed original csv, compressed at the fastest level as csv is parsed per upload
+    source_key = b"vb_source_csv"
+    compression_level = 1
+
+    @staticmethod
+    def is_columnar(data):
+        """
+        :param data: Raw Dataset.data value
+        :return: True if data is stored in the Arrow IPC format, False for csv
+        """
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            return False
+        return bytes(data[:len(DatasetLoader.magic)]) == DatasetLoader.magic
+
+    @staticmethod
+    def encode(data, metadata=None):
+        """
+        Convert dataset input to the columnar storage format.
+        :param data: csv string or bytes, or a Pandas DataFrame
+        :param metadata: Optional dictionary of string keys and values stored in the file schema, see metadata
+        :return: Arrow IPC file bytes
+        """
+        metadata = dict(metadata or {})
+        if isinstance(data, pd.DataFrame):
+            df = data
+        elif DatasetLoader.is_columnar(data):
+            return bytes(data)
+        else:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                data = bytes(data).decode()
+            df = pd.read_csv(StringIO(str(data)))
+            metadata[DatasetLoader.source_key] = zlib.compress(str(data).encode(), DatasetLoader.compression_level)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if metadata:
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+        sink = pa.BufferOutputStream()
+        writer = pa.ipc.new_file(sink, table.schema)
+        writer.write_table(table, max_chunksize=DatasetLoader.batch_size)
+        writer.close()
+        return sink.getvalue().to_pybytes()
+
+    @staticmethod
+    def decode(data, columns=None):
+        """
+        Parse stored dataset data into a DataFrame.
+        :param data: Raw Dataset.data value, Arrow IPC or csv
+        :param columns: Optional list of column names to load, defaults to all columns
+        :return: Pandas DataFrame
+        """
+        if DatasetLoader.is_columnar(data):
+            table = pa.ipc.open_file(pa.py_buffer(data)).read_all()
+            if columns is not None and len(columns) == 0:
+                return pd.DataFrame(index=pd.RangeIndex(table.num_rows))
+            if columns is not None:
+                table = pa.Table.from_arrays([table.column(c) for c in columns], names=list(columns))
+            return table.to_pandas()
+        df = pd.read_csv(StringIO(bytes(data).decode()))
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+
+    @staticmethod
+    def columns(data):
+        """
+        :param data: Raw Dataset.data value, Arrow IPC or csv
+        :return: List of the column names of the stored dataset, without parsing its rows
+        """
+        if DatasetLoader.is_columnar(data):
+            return pa.ipc.open_file(pa.py_buffer(data)).schema.names
+        return list(pd.read_csv(StringIO(bytes(data).decode()), nrows=0).columns)
+
+    @staticmethod
+    def metadata(data):
+        """
+        :param data: Arrow IPC file bytes
+        :return: Dictionary of the string metadata stored by encode
+        """
+        schema = pa.ipc.open_file(pa.py_buffer(data)).schema
+        return {k.decode(): v.decode() for k, v in (schema.metadata or {}).items()
+                if k not in (b"pandas", DatasetLoader.source_key)}
+
+    @staticmethod
+    def iter_chunks(data, chunksize=None):
+        """
+        Iterate over the stored dataset data in row chunks, without parsing the full dataset at once.
+        :param data: Raw Dataset.data value, Arrow IPC or csv
+        :param chunksize: Number of rows per chunk for csv data, Arrow data is read by its stored record batches
+        :return: Generator of Pandas DataFrames
+        """
+        if DatasetLoader.is_columnar(data):
+            reader = pa.ipc.open_file(pa.py_buffer(data))
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).to_pandas()
+        else:
+            for chunk in pd.read_csv(StringIO(bytes(data).decode()), chunksize=chunksize or DatasetLoader.batch_size):
+                yield chunk
+
+    @staticmethod
+    def partitions(data, columns=None):
+        """
+        Partitioned Dask DataFrame of the stored dataset data, one partition per Arrow record batch, csv data is
+        parsed and split into partitions of DatasetLoader.batch_size rows.
+        :param data: Raw Dataset.data value, Arrow IPC or csv
+        :param columns: Optional list of column names to load, defaults to all columns
+        :return: Dask DataFrame
+        """
+        if not DatasetLoader.is_columnar(data):
+            return dd.from_pandas(DatasetLoader.decode(data, columns), chunksize=DatasetLoader.batch_size)
+        reader = pa.ipc.open_file(pa.py_buffer(data))
+        meta = reader.schema.empty_table().to_pandas()
+        if columns is not None:
+            meta = meta[list(columns)]
+        source = delayed(bytes(data), pure=True)
+        parts = [delayed(DatasetLoader.read_batch)(source, i, columns) for i in range(reader.num_record_batches)]
+        return dd.from_delayed(parts, meta=meta)
+
+    @staticmethod
+    def read_batch(data, i, columns=None):
+        """
+        :param data: Arrow IPC file bytes
+        :param i: Record batch index
+        :param columns: Optional list of column names to load, defaults to all columns
+        :return: Pandas DataFrame of the record batch
+        """
+        batch = pa.ipc.open_file(pa.py_buffer(data)).get_batch(i)
+        if columns is not None:
+            batch = pa.RecordBatch.from_arrays([batch.column(batch.schema.get_field_index(c)) for c in columns],
+                                               names=list(columns))
+        return batch.to_pandas()
+
+    @staticmethod
+    def content_hash(data):
+        """
+        :param data: Raw Dataset.data value
+        :return: Hex digest of the stored dataset content
+        """
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    @staticmethod
+    def load(dataset, columns=None):
+        """
+        Load the data of a Dataset, parsed frames are cached per process by dataset id, content hash and columns. A
+        cached full frame also serves the loads of a subset of its columns, otherwise only the requested columns are
+        parsed. The returned DataFrame shares its values with the cache and should not be modified in place.
+        :param dataset: Dataset model instance
+        :param columns: Optional list of column names to load, defaults to all columns
+        :return: Pandas DataFrame
+        """
+        if dataset.id is None:
+            return DatasetLoader.decode(dataset.data, columns)
+        key = (dataset.id, DatasetLoader.content_hash(dataset.data), None)
+        df = dataset_cache.get(key)
+        if df is not None and columns is not None:
+            return df[list(columns)].copy(deep=False)
+        if columns is not None:
+            key = key[:2] + (tuple(columns),)
+            df = dataset_cache.get(key)
+        if df is None:
+            df = DatasetLoader.decode(dataset.data, columns)
+            dataset_cache.put(key, df)
+        return df.copy(deep=False)
+
+    @staticmethod
+    def invalidate(dataset_id):
+        """
+        Remove all cached versions of a dataset from this process's cache.
+        :param dataset_id: Dataset id
+        """
+        dataset_cache.invalidate(lambda k: k[0] == int(dataset_id))
+
+    @staticmethod
+    def cache_info():
+        """
+        :return: Dataset cache size and hit/miss/eviction counters
+        """
+        return dataset_cache.stats()
+
+    @staticmethod
+    def to_csv(dataset):
+        """
+        Recover the uploaded csv of a Dataset. Datasets stored without their original csv are serialized again from
+        the parsed values, which does not preserve their formatting, e.g. leading zeros of codes.
+        :param dataset: Dataset model instance
+        :return: csv string
+        """
+        if DatasetLoader.is_columnar(dataset.data):
+            metadata = pa.ipc.open_file(pa.py_buffer(dataset.data)).schema.metadata or {}
+            if DatasetLoader.source_key in metadata:
+                return zlib.decompress(metadata[DatasetLoader.source_key]).decode()
+            return DatasetLoader.decode(dataset.data).to_csv(index=False)
+        return bytes(dataset.data).decode()
+
+
+class DatasetWriter:
+    """
+    Incremental writer of DataFrame row chunks, as csv or in the Arrow IPC storage format of DatasetLoader. The schema
+    or csv header is taken from the first chunk.
+    """
+    def __init__(self, sink=None, columnar=True):
+        """
+        :param sink: File path or writable file object, defaults to an in-memory buffer read with getvalue()
+        :param columnar: True to write an Arrow IPC file, False to write csv
+        """
+        self.columnar = columnar
+        self.buffer = None
+        self.opened = False
+        if sink is None:
+            self.buffer = pa.BufferOutputStream() if columnar else StringIO()
+            sink = self.buffer
+        elif isinstance(sink, str) and not columnar:
+            sink = open(sink, "w", newline="")
+            self.opened = True
+        self.sink = sink
+        self.schema = None
+        self.writer = None
+        self.rows = 0
+
+    def write(self, df):
+        """
+        :param df: Pandas DataFrame chunk
+        """
+        if self.columnar:
+            if self.writer is None:
+                self.schema = pa.Schema.from_pandas(df, preserve_index=False)
+                self.writer = pa.ipc.new_file(self.sink, self.schema)
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            self.writer.write_table(table, max_chunksize=DatasetLoader.batch_size)
+        else:
+            df.to_csv(self.sink, index=False, header=self.rows == 0)
+        self.rows += df.shape[0]
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.opened:
+            self.sink.close()
+            self.opened = False
+
+    def getvalue(self):
+        """
+        Close the writer and return the content of the in-memory buffer.
+        :return: Arrow IPC file bytes, or a csv string
+        """
+        self.close()
+        if self.columnar:
+            return self.buffer.getvalue().to_pybytes()
+        return self.buffer.getvalue()
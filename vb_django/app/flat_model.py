@@ -0,0 +1,216 @@
+from sklearn.pipeline import Pipeline
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.preprocessing import StandardScaler, FunctionTransformer, PolynomialFeatures
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import r2_score
+from vb_django.app.vb_helper import ShrinkBigKTransformer, InteractionScreener, None_T, LogP1_T, LogMinPlus1_T
+import pandas as pd
+import numpy as np
+
+
+class FlatLinearModel:
+    """
+    Closed-form representation of a fitted automated linear regression pipeline: standardized input columns
+    z = (x[columns] - center) / scale, a linear model over z and the pairwise products of z, with the scalers and
+    column selections after the interactions folded into its weights, and the inverse of the target transform.
+    Predictions equal those of the pipeline up to floating point rounding.
+    """
+    # target transforms y = inverse(f) = expm1(f) + offset, the others are the identity
+    inverses = {LogP1_T: lambda t: -t.min_shift_, LogMinPlus1_T: lambda t: t.x_min_}
+
+    def __init__(self, columns, center, scale, linear, pairs, pair_weights, intercept, inverse=None, offset=0.,
+                 names=None):
+        """
+        :param columns: Indices of the used input columns
+        :param center: Centers of the used input columns
+        :param scale: Scales of the used input columns
+        :param linear: Weights of the standardized columns z
+        :param pairs: Pairs of indices into z of the products, shape (interactions, 2)
+        :param pair_weights: Weights of the products
+        :param intercept: Intercept
+        :param inverse: None, or 'expm1' for a log target transform
+        :param offset: Offset of the inverse target transform
+        :param names: Optional names of the used input columns, selected by name from DataFrame inputs
+        """
+        self.columns = np.asarray(columns, dtype=np.int64)
+        self.center = np.asarray(center, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.linear = np.asarray(linear, dtype=np.float64)
+        self.pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        self.pair_weights = np.asarray(pair_weights, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.inverse = inverse
+        self.offset = float(offset)
+        self.names = list(names) if names is not None else None
+
+    @staticmethod
+    def steps(estimator):
+        """
+        :param estimator: Fitted estimator, searches are replaced by their best estimator
+        :return: List of the fitted steps of the regressor, and the target transformer or None
+        """
+        while hasattr(estimator, "best_estimator_"):
+            estimator = estimator.best_estimator_
+        if isinstance(estimator, Pipeline):
+            steps, target = [], None
+            for _, step in estimator.steps:
+                if step is None or step == "passthrough":
+                    continue
+                if target is not None:
+                    raise ValueError("Steps after a target transformed regressor can not be flattened")
+                step_list, target = FlatLinearModel.steps(step)
+                steps.extend(step_list)
+            return steps, target
+        if isinstance(estimator, TransformedTargetRegressor):
+            steps, target = FlatLinearModel.steps(estimator.regressor_)
+            if target is not None:
+                raise ValueError("Nested target transformers can not be flattened")
+            return steps, estimator.transformer_
+        return [estimator], None
+
+    @staticmethod
+    def export(estimator, names=None):
+        """
+        Flatten a fitted pipeline of StandardScaler, ShrinkBigKTransformer, at most one InteractionScreener or
+        degree 2 PolynomialFeatures and a final LinearRegression, optionally within a TransformedTargetRegressor.
+        :param estimator: Fitted estimator, e.g. the hyper-parameter search of a task or its compact artifact
+        :param names: Optional list of the names of the input columns
+        :return: FlatLinearModel
+        """
+        steps, target = FlatLinearModel.steps(estimator)
+        if not steps or not isinstance(steps[-1], LinearRegression):
+            raise ValueError("Only pipelines ending in a LinearRegression can be flattened")
+        # before the interactions: z = (x[columns] - center) / scale
+        columns, center, scale = None, None, None
+        # after the interactions: feature = a * product of z[monomial] + b
+        monomials, a, b = None, None, None
+        for step in steps[:-1]:
+            if isinstance(step, StandardScaler):
+                mean = step.mean_ if step.mean_ is not None else 0.
+                std = step.scale_ if step.scale_ is not None else 1.
+                if monomials is None:
+                    if columns is None:
+                        columns = np.arange(step.n_features_in_ if hasattr(step, "n_features_in_") else len(std))
+                        center, scale = np.zeros(columns.shape[0]), np.ones(columns.shape[0])
+                    center, scale = center + mean * scale, scale * std
+                else:
+                    a, b = a / std, (b - mean) / std
+            elif isinstance(step, ShrinkBigKTransformer):
+                if monomials is None:
+                    if columns is None:
+                        raise ValueError("Column selection before the first StandardScaler can not be flattened")
+                    columns, center, scale = columns[step.col_select], center[step.col_select], scale[step.col_select]
+                else:
+                    monomials = [monomials[i] for i in step.col_select]
+                    a, b = a[step.col_select], b[step.col_select]
+            elif isinstance(step, (InteractionScreener, PolynomialFeatures)):
+                if monomials is not None or columns is None or step.powers_.shape[1] != columns.shape[0]:
+                    raise ValueError("Interactions of {} can not be flattened".format(type(step).__name__))
+                if step.powers_.sum(axis=1).max() > 2:
+                    raise ValueError("Interactions of a degree higher than 2 can not be flattened")
+                monomials = [tuple(np.repeat(np.arange(p.shape[0]), p)) for p in step.powers_]
+                a, b = np.ones(len(monomials)), np.zeros(len(monomials))
+            else:
+                raise ValueError("Pipeline step {} can not be flattened".format(type(step).__name__))
+        if columns is None:
+            raise ValueError("Pipelines without a StandardScaler can not be flattened")
+        if monomials is None:
+            monomials = [(i,) for i in range(columns.shape[0])]
+            a, b = np.ones(len(monomials)), np.zeros(len(monomials))
+
+        reg = steps[-1]
+        coef = np.ravel(reg.coef_)
+        if coef.shape[0] != len(monomials):
+            raise ValueError("Only single target regressors can be flattened")
+        weights = coef * a
+        intercept = float(np.ravel(reg.intercept_)[0]) + coef @ b
+        linear = np.zeros(columns.shape[0])
+        pair_weights = {}
+        for monomial, w in zip(monomials, weights):
+            if len(monomial) == 0:
+                intercept += w
+            elif len(monomial) == 1:
+                linear[monomial[0]] += w
+            else:
+                pair_weights[monomial] = pair_weights.get(monomial, 0.) + w
+        pairs = np.array(sorted(pair_weights.keys()), dtype=np.int64).reshape(-1, 2)
+        pair_weights = np.array([pair_weights[tuple(p)] for p in pairs])
+
+        # keep the input columns used by a non-zero weight
+        used = np.union1d(np.flatnonzero(linear), pairs[pair_weights != 0].ravel()).astype(np.int64)
+        index = np.full(columns.shape[0], -1)
+        index[used] = np.arange(used.shape[0])
+        keep = pair_weights != 0
+        pairs, pair_weights = index[pairs[keep]].reshape(-1, 2), pair_weights[keep]
+
+        inverse, offset = None, 0.
+        if target is not None and type(target) in FlatLinearModel.inverses:
+            inverse, offset = "expm1", FlatLinearModel.inverses[type(target)](target)
+        elif not (target is None or isinstance(target, None_T) or
+                  isinstance(target, FunctionTransformer) and target.inverse_func is None):
+            raise ValueError("Target transformer {} can not be flattened".format(type(target).__name__))
+        return FlatLinearModel(
+            columns[used], center[used], scale[used], linear[used], pairs, pair_weights, intercept, inverse, offset,
+            names=[names[i] for i in columns[used]] if names is not None else None
+        )
+
+    def predict(self, X):
+        """
+        :param X: DataFrame or 2-D array of the input columns of the pipeline, DataFrame columns are selected by name
+        when the model has names
+        :return: 1-D array of predictions
+        """
+        columns = self.columns
+        if self.names is not None and isinstance(X, pd.DataFrame):
+            columns = X.columns.get_indexer(self.names)
+            if np.any(columns < 0):
+                raise KeyError("Missing feature columns: {}".format(
+                    ", ".join(n for n, i in zip(self.names, columns) if i < 0)))
+        # only the used columns are selected and converted, other columns of any dtype are ignored
+        if isinstance(X, pd.DataFrame):
+            x = X.iloc[:, columns].to_numpy(dtype=np.float64)
+        else:
+            x = np.asarray(X)[:, columns].astype(np.float64, copy=False)
+        z = (x - self.center) / self.scale
+        y = z @ self.linear + self.intercept
+        if self.pairs.shape[0] > 0:
+            y += (z[:, self.pairs[:, 0]] * z[:, self.pairs[:, 1]]) @ self.pair_weights
+        if self.inverse == "expm1":
+            y = np.expm1(y) + self.offset
+        return y
+
+    def score(self, X, y):
+        """
+        :return: R^2 of the predictions of X, as RegressorMixin.score
+        """
+        return r2_score(y, self.predict(X))
+
+    @property
+    def nbytes(self):
+        return sum(v.nbytes for v in (self.columns, self.center, self.scale, self.linear, self.pairs,
+                                      self.pair_weights))
+
+    def to_dict(self):
+        """
+        :return: JSON serializable dictionary of the model, see from_dict
+        """
+        return {
+            "columns": self.columns.tolist(),
+            "names": self.names,
+            "center": self.center.tolist(),
+            "scale": self.scale.tolist(),
+            "linear": self.linear.tolist(),
+            "pairs": self.pairs.tolist(),
+            "pair_weights": self.pair_weights.tolist(),
+            "intercept": self.intercept,
+            "inverse": self.inverse,
+            "offset": self.offset
+        }
+
+    @staticmethod
+    def from_dict(values):
+        """
+        :param values: Dictionary returned by to_dict
+        :return: FlatLinearModel
+        """
+        return FlatLinearModel(**values)
@@ -1,18 +1,19 @@
 from sklearn.model_selection import RepeatedKFold, GridSearchCV, train_test_split
 from sklearn.pipeline import make_pipeline, Pipeline
-from sklearn.preprocessing import StandardScaler, PolynomialFeatures
+from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LinearRegression
 from sklearn.compose import TransformedTargetRegressor
-from vb_django.app.vb_helper import ShrinkBigKTransformer, None_T, LogP1_T
-from dask.distributed import Client
+from vb_django.app.vb_helper import ShrinkBigKTransformer, InteractionScreener, None_T, LogP1_T, PipelineMemory
+from vb_django.app.vb_helper import clear_caches
+from vb_django.app.search import HalvingGridSearchCV, BudgetGridSearchCV
+from dask.distributed import get_worker, get_client
 # from dask import array as darray
 import pandas as pd
 import numpy as np
 import joblib
 import warnings
-import os
-import socket
 import time
+import uuid
 import logging
 
 
@@ -31,13 +32,20 @@ class LinearRegressionAutomatedVB:
     id = "lra"
     description = "Automated pipeline with feature evaluation and selection for a linear regression estimator."
 
-    def __init__(self, test_split=0.2, cv_folds=10, cv_reps=10, seed=42, one_out=False):
+    def __init__(self, test_split=0.2, cv_folds=10, cv_reps=10, seed=42, one_out=False, n_jobs=-1,
+                 parallel_backend="auto", search="grid", search_factor=3, max_seconds=600, max_interactions=256):
         self.hyperparameters = {
             'test_split': 0.2,
             'cv_folds': 10,
             'cv_reps': 10,
             'random_seed': 42,
-            'one_out': False
+            'one_out': False,
+            'n_jobs': -1,                   # parallel cross-validation fits, -1 for all cores or Dask worker threads
+            'parallel_backend': "auto",     # 'local', 'dask' or 'auto' (dask when running on a Dask worker)
+            'search': "grid",               # max_k search: 'grid', 'halving' (successive halving) or 'budget'
+            'search_factor': 3,             # halving: 1/factor of the candidates kept per round, folds x factor
+            'max_seconds': 600,             # budget: time budget of the whole search
+            'max_interactions': 256         # number of screened pairwise interaction features
         }
         self.start_time = time.time()
         self.test_split = test_split
@@ -45,6 +53,12 @@ class LinearRegressionAutomatedVB:
         self.cv_reps = cv_reps
         self.seed = seed
         self.one_out = one_out
+        self.n_jobs = n_jobs
+        self.parallel_backend = parallel_backend
+        self.search = search
+        self.search_factor = search_factor
+        self.max_seconds = max_seconds
+        self.max_interactions = max_interactions
 
         self.k = None
         self.n = None
@@ -67,6 +81,14 @@ class LinearRegressionAutomatedVB:
         self.cv_reps = int(self.hyperparameters['cv_reps'])
         self.seed = int(self.hyperparameters['random_seed'])
         self.one_out = bool(self.hyperparameters['one_out'])
+        self.n_jobs = int(self.hyperparameters['n_jobs'])
+        self.parallel_backend = str(self.hyperparameters['parallel_backend'])
+        self.search = str(self.hyperparameters['search'])
+        self.search_factor = int(self.hyperparameters['search_factor'])
+        self.max_seconds = float(self.hyperparameters['max_seconds'])
+        self.max_interactions = int(self.hyperparameters['max_interactions'])
+        if self.search not in ("grid", "halving", "budget"):
+            raise ValueError("Unknown search strategy: {}".format(self.search))
 
     def set_data(self, x, y):
         if self.one_out:
@@ -82,33 +104,105 @@ class LinearRegressionAutomatedVB:
     def set_pipeline(self):
         warnings.simplefilter('ignore')
 
+        # fitted prefixes of the pipeline are reused across the grid points of a fold, for the duration of the task
+        memory = PipelineMemory(uuid.uuid4().hex)
         transformer_list = [None_T(), LogP1_T()]
         steps = [
             ('scaler', StandardScaler()),
-            ('shrink_k1', ShrinkBigKTransformer()),
-            ('polyfeat', PolynomialFeatures(interaction_only=1)),
-            ('shrink_k2', ShrinkBigKTransformer(selector='elastic-net')),
+            ('shrink_k1', ShrinkBigKTransformer(selector='lars-path', namespace=memory.namespace)),
+            ('interactions', InteractionScreener(max_interactions=self.max_interactions)),
+            ('shrink_k2', ShrinkBigKTransformer(selector='elastic-net-gram', namespace=memory.namespace)),
             ('reg', make_pipeline(StandardScaler(), LinearRegression(fit_intercept=1)))
         ]
 
-        inner_params = {'polyfeat__degree': [2]}
+        inner_params = {}
         if self.k > 4:
             interv = -(-self.k // 3)
             np.arange(2, self.k + interv, interv)
             inner_params['shrink_k1__max_k'] = np.arange(4, self.k, 4)
         inner_cv = RepeatedKFold(n_splits=5, n_repeats=1, random_state=self.seed)
-        X_T_pipe = GridSearchCV(Pipeline(steps=steps), param_grid=inner_params, cv=inner_cv)
+        X_T_pipe = self.inner_search(Pipeline(steps=steps, memory=memory), inner_params, inner_cv)
 
         Y_T_X_T_pipe = Pipeline(steps=[('ttr', TransformedTargetRegressor(regressor=X_T_pipe))])
         Y_T__param_grid = {'ttr__transformer': transformer_list}
-        lin_reg_Xy_transform = GridSearchCV(Y_T_X_T_pipe, param_grid=Y_T__param_grid, cv=inner_cv)
+        lin_reg_Xy_transform = GridSearchCV(
+            Y_T_X_T_pipe, param_grid=Y_T__param_grid, cv=inner_cv, n_jobs=self.n_jobs
+        )
 
         self.lr_estimator = lin_reg_Xy_transform
-        self.lr_estimator.fit(self.x_train, self.y_train)
+        try:
+            self.fit_search()
+        finally:
+            self.clear_caches(memory.namespace)
         self.attr = pd.DataFrame(self.lr_estimator.cv_results_)
         # generates the model that is saved
         logger.info("Total execution time: {} sec".format(round(time.time() - self.start_time, 3)))
 
+    def inner_search(self, pipeline, param_grid, cv):
+        """
+        Budget searches share one deadline, max_seconds from now, over all the inner searches fitted by the outer
+        search: inner searches fitted after the deadline evaluate a single candidate. The budget is a soft limit.
+        :param pipeline: Pipeline of the inner search
+        :param param_grid: Parameter grid of the inner search
+        :param cv: Cross-validation splitter
+        :return: Inner search estimator for the configured search strategy
+        """
+        if self.search == "halving":
+            return HalvingGridSearchCV(pipeline, param_grid, factor=self.search_factor, cv=cv)
+        if self.search == "budget":
+            return BudgetGridSearchCV(pipeline, param_grid, max_seconds=self.max_seconds,
+                                      deadline=time.time() + self.max_seconds, random_state=self.seed, cv=cv)
+        return GridSearchCV(pipeline, param_grid=param_grid, cv=cv)
+
+    def clear_caches(self, namespace):
+        """
+        Clear the pipeline, LARS path and Gram cache entries of the search namespace, in this process and on all the
+        workers of the Dask cluster. Entries left on the joblib workers of the local backend are not shared with other
+        tasks and are evicted by the size bounds of the caches.
+        :param namespace: PipelineMemory namespace of the search
+        """
+        clear_caches(namespace)
+        if self.search_backend() == "dask":
+            try:
+                get_client().run(clear_caches, namespace)
+            except Exception as ex:
+                logger.warning("Error clearing the worker caches: {}".format(ex))
+
+    def search_backend(self):
+        """
+        :return: 'dask' to run the search on the Dask joblib backend, or 'local' for joblib's default backend
+        """
+        if self.parallel_backend == "local":
+            return "local"
+        try:
+            get_worker()
+        except ValueError:
+            if self.parallel_backend == "dask":
+                logger.warning("Dask parallel backend requested outside of a Dask worker, using local n_jobs")
+            return "local"
+        return "dask"
+
+    def fit_search(self):
+        """
+        Fit the hyper-parameter search, its cross-validation fits run in parallel on the configured backend. Folds and
+        estimators are seeded, so the fitted model does not depend on the backend or the number of jobs.
+        """
+        backend = self.search_backend()
+        t0 = time.time()
+        if backend == "dask":
+            # the Dask backend secedes the task from the worker thread pool while the fits run on the cluster
+            with joblib.parallel_backend("dask"):
+                self.lr_estimator.fit(self.x_train, self.y_train)
+        else:
+            self.lr_estimator.fit(self.x_train, self.y_train)
+        wall_time = time.time() - t0
+        results = self.lr_estimator.cv_results_
+        fits = len(results["params"]) * self.lr_estimator.n_splits_
+        fit_time = np.sum(results["mean_fit_time"] + results["mean_score_time"]) * self.lr_estimator.n_splits_
+        logger.info("Hyper-parameter search: {} fits, {} backend, n_jobs={}, wall time {} sec, total fit time {} sec, "
+                    "fit/wall time ratio {}".format(fits, backend, self.n_jobs, round(wall_time, 3),
+                                                    round(fit_time, 3), round(fit_time / wall_time, 2)))
+
     def predict(self, x_test=None):
         # obsolete within dask stack
         x_test = x_test if x_test else self.x_test
@@ -0,0 +1,236 @@
+from sklearn.pipeline import Pipeline
+from sklearn.compose import TransformedTargetRegressor
+from vb_django.app.cache import LRUCache
+from vb_django.app.flat_model import FlatLinearModel
+import sklearn
+import hashlib
+import logging
+import pickle
+import struct
+import copy
+import json
+import zlib
+import os
+
+
+logger = logging.getLogger("vb_dask")
+
+# Per process cache of loaded models, keyed by (model id, ModelArtifact.checksum[, 'predictor']), values are
+# (estimator, bytes)
+model_cache = LRUCache(
+    max_size=int(os.getenv("VB_MODEL_CACHE_MB", 256)) * 1024 * 1024,
+    max_entries=int(os.getenv("VB_MODEL_CACHE_ENTRIES", 64)),
+    sizeof=lambda v: v[1]
+)
+
+
+class ModelArtifact:
+    """
+    Storage format of AnalyticalModel.model. A fitted estimator is stored as its refit best pipeline, without the
+    search objects, cross-validation results and unfitted templates, pickled with protocol 5. Buffers of large arrays
+    are stored out-of-band after the pickle stream, at aligned offsets, zlib compressed when that saves enough space,
+    uncompressed buffers are loaded without a copy. Models saved as plain pickles are still loaded.
+
+    Layout: header (magic, version, buffer count, metadata length, pickle length, checksum of the rest of the file),
+    buffer table (offset, length, compressed flag), JSON metadata, zlib compressed pickle stream, buffers.
+    """
+    magic = b"VBMODEL\x00"
+    version = 1
+    header = struct.Struct("<8sHHIQ16s")
+    entry = struct.Struct("<QQ?7x")
+    alignment = 64
+    min_buffer_size = 4096
+    compression_level = 6
+    compression_ratio = 0.8
+
+    @staticmethod
+    def is_artifact(data):
+        """
+        :param data: Raw AnalyticalModel.model value
+        :return: True if data is stored in the artifact format, False for a plain pickle
+        """
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            return False
+        return bytes(data[:len(ModelArtifact.magic)]) == ModelArtifact.magic
+
+    @staticmethod
+    def compact(estimator):
+        """
+        Strip a fitted estimator down to what prediction needs: searches are replaced by their refit best estimator,
+        pipeline memories and the unfitted regressor templates of target transformers are dropped. Estimators are
+        copied, not modified.
+        :param estimator: Fitted estimator
+        :return: Compact fitted estimator
+        """
+        if hasattr(estimator, "best_estimator_"):
+            return ModelArtifact.compact(estimator.best_estimator_)
+        if isinstance(estimator, Pipeline):
+            estimator = copy.copy(estimator)
+            estimator.steps = [(name, ModelArtifact.compact(step)) for name, step in estimator.steps]
+            estimator.memory = None
+        elif isinstance(estimator, TransformedTargetRegressor) and hasattr(estimator, "regressor_"):
+            estimator = copy.copy(estimator)
+            estimator.regressor_ = ModelArtifact.compact(estimator.regressor_)
+            estimator.regressor = estimator.regressor_
+        return estimator
+
+    @staticmethod
+    def dumps(estimator, metadata=None):
+        """
+        :param estimator: Fitted estimator, e.g. the hyper-parameter search of a task
+        :param metadata: Optional JSON serializable dictionary stored with the model, see metadata
+        :return: Artifact bytes of the compact estimator
+        """
+        buffers = []
+
+        def out_of_band(buffer):
+            raw = buffer.raw()
+            if raw.nbytes < ModelArtifact.min_buffer_size:
+                return True
+            buffers.append(raw)
+            return False
+        stream = pickle.dumps(ModelArtifact.compact(estimator), protocol=5, buffer_callback=out_of_band)
+        stream = zlib.compress(stream, ModelArtifact.compression_level)
+        meta = json.dumps(dict(metadata or {}, sklearn=sklearn.__version__)).encode()
+
+        offset = ModelArtifact.align(ModelArtifact.header.size + ModelArtifact.entry.size * len(buffers) +
+                                     len(meta) + len(stream))
+        table, segments = [], []
+        for raw in buffers:
+            packed = zlib.compress(raw, ModelArtifact.compression_level)
+            compressed = len(packed) < ModelArtifact.compression_ratio * raw.nbytes
+            segment = packed if compressed else raw
+            table.append(ModelArtifact.entry.pack(offset, len(segment), compressed))
+            segments.append((offset, segment))
+            offset = ModelArtifact.align(offset + len(segment))
+
+        data = bytearray(offset)
+        content = b"".join(table) + meta + stream
+        data[ModelArtifact.header.size:ModelArtifact.header.size + len(content)] = content
+        for offset, segment in segments:
+            data[offset:offset + len(segment)] = segment
+        checksum = hashlib.blake2b(memoryview(data)[ModelArtifact.header.size:], digest_size=16).digest()
+        ModelArtifact.header.pack_into(data, 0, ModelArtifact.magic, ModelArtifact.version, len(buffers), len(meta),
+                                       len(stream), checksum)
+        return bytes(data)
+
+    @staticmethod
+    def loads(data):
+        """
+        :param data: Raw AnalyticalModel.model value, artifact or plain pickle
+        :return: Fitted estimator, arrays of uncompressed buffers are read-only views of data
+        """
+        return ModelArtifact.decode(data)[0]
+
+    @staticmethod
+    def decode(data):
+        """
+        :param data: Raw AnalyticalModel.model value, artifact or plain pickle
+        :return: Fitted estimator and the size of its decoded pickle stream and buffers in bytes
+        """
+        if not ModelArtifact.is_artifact(data):
+            return pickle.loads(data), len(data)
+        data = memoryview(data)
+        _, version, count, meta_size, stream_size, checksum = ModelArtifact.header.unpack_from(data)
+        if version > ModelArtifact.version:
+            raise ValueError("Unsupported model artifact version: {}".format(version))
+        if hashlib.blake2b(data[ModelArtifact.header.size:], digest_size=16).digest() != checksum:
+            raise ValueError("Model artifact checksum mismatch")
+        position = ModelArtifact.header.size + ModelArtifact.entry.size * count
+        meta = json.loads(bytes(data[position:position + meta_size]))
+        if meta.get("sklearn") != sklearn.__version__:
+            logger.warning("Model artifact saved with scikit-learn {}, loading with {}".format(
+                meta.get("sklearn"), sklearn.__version__))
+        position += meta_size
+        stream = zlib.decompress(data[position:position + stream_size])
+        buffers = []
+        for i in range(count):
+            offset, size, compressed = ModelArtifact.entry.unpack_from(
+                data, ModelArtifact.header.size + ModelArtifact.entry.size * i)
+            segment = data[offset:offset + size]
+            buffers.append(zlib.decompress(segment) if compressed else segment)
+        return pickle.loads(stream, buffers=buffers), len(stream) + sum(len(b) for b in buffers)
+
+    @staticmethod
+    def load(amodel):
+        """
+        Load the fitted model of an AnalyticalModel, loaded models are cached per process by model id and checksum.
+        The returned estimator is shared with the cache and should not be modified.
+        :param amodel: AnalyticalModel model instance
+        :return: Fitted estimator
+        """
+        key = (amodel.id, ModelArtifact.checksum(amodel.model))
+        entry = model_cache.get(key)
+        if entry is None:
+            entry = ModelArtifact.decode(amodel.model)
+            model_cache.invalidate(lambda k: k[0] == amodel.id and k[1] != key[1])
+            model_cache.put(key, entry)
+        return entry[0]
+
+    @staticmethod
+    def load_predictor(amodel):
+        """
+        Load the fastest predictor of an AnalyticalModel: the FlatLinearModel exported with the artifact, exported from
+        the loaded estimator for models stored without one, or the estimator if it can not be flattened. Predictors
+        are cached per process as load.
+        :param amodel: AnalyticalModel model instance
+        :return: FlatLinearModel or fitted estimator, both providing predict and score
+        """
+        key = (amodel.id, ModelArtifact.checksum(amodel.model), "predictor")
+        entry = model_cache.get(key)
+        if entry is None:
+            flat = None
+            if ModelArtifact.is_artifact(amodel.model):
+                flat = ModelArtifact.metadata(amodel.model).get("flat")
+            if flat is not None:
+                predictor = FlatLinearModel.from_dict(flat)
+            else:
+                predictor = ModelArtifact.load(amodel)
+                try:
+                    predictor = FlatLinearModel.export(predictor)
+                except ValueError as ex:
+                    logger.info("Model ID: {}, using the fitted pipeline for predictions: {}".format(amodel.id, ex))
+            entry = (predictor, getattr(predictor, "nbytes", 0) + 1024)
+            model_cache.invalidate(lambda k: k[0] == amodel.id and k[1] != key[1])
+            model_cache.put(key, entry)
+        return entry[0]
+
+    @staticmethod
+    def invalidate(model_id):
+        """
+        Remove all cached versions of a model from this process's cache.
+        :param model_id: AnalyticalModel id
+        """
+        model_cache.invalidate(lambda k: k[0] == int(model_id))
+
+    @staticmethod
+    def cache_info():
+        """
+        :return: Model cache size and hit/miss/eviction counters
+        """
+        return model_cache.stats()
+
+    @staticmethod
+    def metadata(data):
+        """
+        :param data: Artifact bytes
+        :return: Dictionary of the metadata stored by dumps
+        """
+        data = memoryview(data)
+        _, _, count, meta_size, _, _ = ModelArtifact.header.unpack_from(data)
+        position = ModelArtifact.header.size + ModelArtifact.entry.size * count
+        return json.loads(bytes(data[position:position + meta_size]))
+
+    @staticmethod
+    def checksum(data):
+        """
+        :param data: Raw AnalyticalModel.model value
+        :return: Hex digest identifying the stored model, the header checksum of artifacts
+        """
+        if ModelArtifact.is_artifact(data):
+            return ModelArtifact.header.unpack_from(memoryview(data))[5].hex()
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    @staticmethod
+    def align(offset):
+        return -(-offset // ModelArtifact.alignment) * ModelArtifact.alignment
@@ -2,7 +2,22 @@ import networkx as nx
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
+from vb_django.app.cache import LRUCache
+from vb_django.app.dataset_loader import DatasetLoader, DatasetWriter
+from dask import delayed
+import dask
+import dask.dataframe as dd
 import os, copy
+import hashlib
+import json
+
+
+# Per process cache of step outputs, keyed by ((dataset id, dataset content hash), step signature)
+preprocessing_cache = LRUCache(
+    max_size=int(os.getenv("VB_PREPROCESSING_CACHE_MB", 256)) * 1024 * 1024,
+    sizeof=lambda a: a.nbytes
+)
 
 
 class DAGFunctions:
@@ -85,6 +100,490 @@ class DAGFunctions:
         return df
 
 
+class DAGKernels:
+    """
+    Array implementations of the DAGFunctions operations used by the compiled PPPlan, each writing its result into the
+    optional out array.
+    """
+    # Input column arguments and output column name of each operation, matching the DAGFunctions column names
+    signatures = {
+        "add": (("c1", "c2"), "{c1}+{c2}"),
+        "subtract": (("c1", "c2"), "{c1}-{c2}"),
+        "normalize": (("c",), "{c}n"),
+        "square": (("c",), "({c})^2"),
+        "log": (("c",), "ln({c})"),
+        "log10": (("c",), "log10({c})")
+    }
+    # Operations depending on a reduction over all rows: the partial reduction of a chunk of the inputs, and the kernel
+    # keyword arguments given the list of partial reductions. All other operations are row-local.
+    reductions = {
+        "normalize": (lambda a: np.sum(np.square(a, dtype=np.float64)), lambda p: {"norm": np.sqrt(np.sum(p))})
+    }
+
+    @staticmethod
+    def add(a, b, out=None):
+        return np.add(a, b, out=out)
+
+    @staticmethod
+    def subtract(a, b, out=None):
+        return np.subtract(a, b, out=out)
+
+    @staticmethod
+    def normalize(a, out=None, norm=None):
+        return np.divide(a, np.linalg.norm(a) if norm is None else norm, out=out)
+
+    @staticmethod
+    def square(a, out=None):
+        return np.square(a, out=out)
+
+    @staticmethod
+    def log(a, out=None):
+        return np.log(a, out=out)
+
+    @staticmethod
+    def log10(a, out=None):
+        return np.log10(a, out=out)
+
+
+class PPStep:
+    """
+    A single operation of a PPPlan, reading input columns by name and producing one output column.
+    """
+    def __init__(self, node, function, args):
+        """
+        :param node: PPGraph node id
+        :param function: Name of the DAGFunctions operation
+        :param args: Operation arguments, the input column names
+        """
+        self.node = node
+        self.function = function
+        self.args = {k: v for k, v in args.items() if k != "df"}
+        input_args, output_format = DAGKernels.signatures[function]
+        self.inputs = [self.args[a] for a in input_args]
+        self.output = output_format.format(**self.args)
+        self.kernel = getattr(DAGKernels, function)
+        self.requested = True
+
+
+class PPFusedStep:
+    """
+    A linear chain of row-local PPSteps evaluated as one kernel. Each operation after the first reads the result of
+    the previous one, the chain is evaluated in row blocks writing into a single output array, so intermediate results
+    are neither allocated as full columns nor read back from memory.
+    """
+    # Number of rows evaluated at a time, keeping the block intermediates in the CPU cache
+    block_rows = 16384
+
+    def __init__(self, steps, chain):
+        """
+        :param steps: List of the PPSteps of a PPPlan
+        :param chain: Indices of the chain steps in execution order, each step reads the output of the previous one
+        """
+        last = steps[chain[-1]]
+        self.node = last.node
+        self.nodes = [steps[i].node for i in chain]
+        self.function = "fused"
+        self.output = last.output
+        self.requested = last.requested
+        self.inputs = []
+        # each operation as (kernel, argument references), None referring to the result of the previous operation
+        self.program = []
+        for k, i in enumerate(chain):
+            refs = []
+            for c, d in zip(steps[i].inputs, steps[i].sources):
+                if k > 0 and d == chain[k - 1]:
+                    refs.append(None)
+                else:
+                    refs.append(len(self.inputs))
+                    self.inputs.append(c)
+            self.program.append((steps[i].kernel, refs))
+        self.args = {"program": [[steps[i].function, sorted(steps[i].args.items()), refs]
+                                 for i, (_, refs) in zip(chain, self.program)]}
+
+    def dtypes(self, dtypes):
+        """
+        :param dtypes: Input dtypes
+        :return: Result dtype of each operation of the chain
+        """
+        result = []
+        previous = None
+        with np.errstate(all='ignore'):
+            for f, refs in self.program:
+                previous = f(*[np.empty(0, dtype=previous if r is None else dtypes[r]) for r in refs]).dtype
+                result.append(previous)
+        return result
+
+    def kernel(self, *inputs, out=None):
+        dtypes = self.dtypes([a.dtype for a in inputs])
+        if out is None:
+            out = np.empty(inputs[0].shape[0], dtype=dtypes[-1])
+        for start in range(0, out.shape[0], self.block_rows):
+            block = slice(start, start + self.block_rows)
+            result = None
+            for (f, refs), dtype in zip(self.program, dtypes):
+                # operations of the output dtype are evaluated in place in the output block
+                result = f(*[result if r is None else inputs[r][block] for r in refs],
+                           out=out[block] if dtype == out.dtype else None)
+        return out
+
+
+class PPPlan:
+    """
+    Compiled execution plan of a PPGraph over numpy arrays. Each step reads its inputs from the source DataFrame or
+    from earlier step outputs and writes into its column of a preallocated output buffer, one buffer per result dtype,
+    so the output frame is built once instead of growing the DataFrame with an insert per operation.
+    Steps are grouped into generations of mutually independent steps, which can be executed concurrently on a thread
+    pool since the numpy kernels release the GIL. Output columns keep their compiled positions, so the result does not
+    depend on the execution order.
+    Each step has a signature hashing its operation, arguments and the signatures of the steps producing its inputs,
+    so step outputs can be cached per dataset version and reused when other parts of a configuration change.
+    """
+    # Default number of threads and minimum row count for concurrent execution of a generation
+    workers = int(os.getenv("VB_PREPROCESSING_WORKERS", min(4, os.cpu_count() or 1)))
+    parallel_rows = int(os.getenv("VB_PREPROCESSING_PARALLEL_ROWS", 50000))
+
+    def __init__(self, steps, edges=()):
+        """
+        :param steps: List of PPStep in execution order
+        :param edges: Graph edges as (node, node) pairs, ordering dependencies in addition to the input columns
+        """
+        self.steps = steps
+        self.edges = [e for e in edges]
+        index = {step.node: i for i, step in enumerate(steps)}
+        producers = {}
+        generation = []
+        for i, step in enumerate(steps):
+            # an input column refers to the latest earlier step producing it, otherwise to the source data
+            step.sources = [producers.get(c) for c in step.inputs]
+            depends = {d for d in step.sources if d is not None}
+            depends.update(index[e[0]] for e in self.edges if e[1] == step.node and e[0] in index)
+            generation.append(1 + max([generation[d] for d in depends]) if depends else 0)
+            producers[step.output] = i
+            upstream = [["column", c] if d is None else ["step", steps[d].signature] for c, d in zip(step.inputs,
+                                                                                                   step.sources)]
+            step.signature = hashlib.sha1(
+                json.dumps([step.function, sorted(step.args.items()), upstream]).encode()
+            ).hexdigest()
+        self.producers = producers
+        self.generations = [[i for i, g in enumerate(generation) if g == level]
+                            for level in range(max(generation) + 1 if generation else 0)]
+        # generation after which the output of an intermediate (not requested) step is no longer read
+        self.release = {}
+        for i, step in enumerate(steps):
+            for d in step.sources:
+                if d is not None and not steps[d].requested:
+                    self.release[d] = max(self.release.get(d, 0), generation[i])
+
+    @property
+    def source_columns(self):
+        """
+        :return: List of the source data columns read by the plan
+        """
+        columns = {}
+        for step in self.steps:
+            columns.update((c, None) for c, d in zip(step.inputs, step.sources) if d is None)
+        return list(columns)
+
+    def unknown(self, outputs, columns):
+        """
+        :param outputs: List of requested output column names
+        :param columns: Column names of the source data
+        :return: List of the requested names that are neither a step output nor a source column
+        """
+        return [c for c in outputs if c not in self.producers and c not in columns]
+
+    def prune(self, outputs):
+        """
+        Reduce the plan to the steps needed for the requested output columns. Steps that are only evaluated as inputs
+        of requested steps are not part of the result.
+        :param outputs: List of requested output column names, names of source columns are ignored, see unknown
+        :return: PPPlan
+        """
+        needed = set()
+        pending = [self.producers[c] for c in outputs if c in self.producers]
+        while pending:
+            i = pending.pop()
+            if i not in needed:
+                needed.add(i)
+                pending.extend([d for d in self.steps[i].sources if d is not None])
+        steps = []
+        for i in sorted(needed):
+            step = copy.copy(self.steps[i])
+            step.requested = step.output in outputs and self.producers[step.output] == i
+            steps.append(step)
+        nodes = set(step.node for step in steps)
+        return PPPlan(steps, [e for e in self.edges if e[0] in nodes and e[1] in nodes])
+
+    def fuse(self):
+        """
+        Merge linear chains of row-local steps into PPFusedSteps. A step is merged into its consumer when its output is
+        not requested and is read only once, by that consumer, each step merging at most one preceding step.
+        :return: PPPlan
+        """
+        uses = {}
+        for step in self.steps:
+            for d in step.sources:
+                if d is not None:
+                    uses[d] = uses.get(d, 0) + 1
+        index = {step.node: i for i, step in enumerate(self.steps)}
+        previous = {}
+        for i, step in enumerate(self.steps):
+            if step.function in DAGKernels.reductions:
+                continue
+            for d in step.sources:
+                if d is None or self.steps[d].requested or uses[d] > 1:
+                    continue
+                if self.steps[d].function in DAGKernels.reductions:
+                    continue
+                if any(e[0] == self.steps[d].node and index.get(e[1]) != i for e in self.edges):
+                    continue
+                previous[i] = d
+                break
+        merged = set(previous.values())
+        steps = []
+        for i, step in enumerate(self.steps):
+            if i in merged:
+                continue
+            if i not in previous:
+                steps.append(step)
+                continue
+            chain = [i]
+            while chain[0] in previous:
+                chain.insert(0, previous[chain[0]])
+            steps.append(PPFusedStep(self.steps, chain))
+        # edges into merged steps order the fused step
+        node = {s: step.node for step in steps for s in getattr(step, "nodes", [step.node])}
+        edges = [(node[e[0]], node[e[1]]) for e in self.edges if e[0] in node and e[1] in node]
+        return PPPlan(steps, [e for e in edges if e[0] != e[1]])
+
+    def dtypes(self, data):
+        """
+        Resolve the result dtype of each step by evaluating the kernels on empty arrays.
+        :param data: Source Pandas DataFrame
+        :return: List of numpy dtypes, one per step
+        """
+        dtypes = {}
+        result = []
+        for step in self.steps:
+            inputs = [np.empty(0, dtype=dtypes[c] if c in dtypes else data[c].dtype) for c in step.inputs]
+            with np.errstate(all='ignore'):
+                dtypes[step.output] = step.kernel(*inputs).dtype
+            result.append(dtypes[step.output])
+        return result
+
+    @staticmethod
+    def invalidate(dataset_id):
+        """
+        Remove the cached step outputs of all versions of a dataset from this process's cache.
+        :param dataset_id: Dataset id
+        """
+        preprocessing_cache.invalidate(lambda k: k[0][0] == int(dataset_id))
+
+    def execute(self, data, workers=None, cache_key=None, reduced=None):
+        """
+        :param data: Source Pandas DataFrame
+        :param workers: Number of threads, defaults to PPPlan.workers for datasets of at least PPPlan.parallel_rows rows
+        :param cache_key: Optional (dataset id, content hash) of the data, enabling the step output cache
+        :param reduced: Optional dictionary of step index to precomputed reduction arguments, see PPStreamExecutor
+        :return: DataFrame of the source columns followed by the output column of each requested step
+        """
+        reduced = reduced if reduced else {}
+        dtypes = self.dtypes(data)
+        requested = [i for i, step in enumerate(self.steps) if step.requested]
+        slots = {}
+        groups = {}
+        for i in requested:
+            slots[i] = (dtypes[i], groups.get(dtypes[i], 0))
+            groups[dtypes[i]] = groups.get(dtypes[i], 0) + 1
+        buffers = {dtype: np.empty((data.shape[0], size), dtype=dtype, order='F') for dtype, size in groups.items()}
+        sources = {c: data[c].to_numpy() for c in self.source_columns}
+        outputs = [None] * len(self.steps)
+
+        def run(i):
+            step = self.steps[i]
+            out = buffers[slots[i][0]][:, slots[i][1]] if step.requested else None
+            if cache_key is not None:
+                cached = preprocessing_cache.get((cache_key, step.signature))
+                if cached is not None:
+                    if out is None:
+                        return cached
+                    out[:] = cached
+                    return out
+            inputs = [sources[c] if d is None else outputs[d] for c, d in zip(step.inputs, step.sources)]
+            result = step.kernel(*inputs, out=out, **reduced.get(i, {}))
+            if cache_key is not None:
+                preprocessing_cache.put((cache_key, step.signature), result.copy() if step.requested else result)
+            return result
+
+        if workers is None:
+            workers = PPPlan.workers if data.shape[0] >= PPPlan.parallel_rows else 1
+        pool = None
+        if workers > 1 and any(len(g) > 1 for g in self.generations):
+            pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for level, g in enumerate(self.generations):
+                for i, result in zip(g, pool.map(run, g) if pool else map(run, g)):
+                    outputs[i] = result
+                for d in [d for d, last in self.release.items() if last == level]:
+                    outputs[d] = None
+        finally:
+            if pool:
+                pool.shutdown()
+        frames = [pd.DataFrame(buffers[dtype], index=data.index, copy=False,
+                               columns=[self.steps[i].output for i in requested if slots[i][0] == dtype])
+                  for dtype in groups.keys()]
+        result = pd.concat([data] + frames, axis=1)
+        if len(frames) > 1:
+            position = {slot: data.shape[1] + i for i, slot in enumerate(
+                [(dtype, j) for dtype in groups.keys() for j in range(groups[dtype])])}
+            result = result.iloc[:, list(range(data.shape[1])) + [position[slots[i]] for i in requested]]
+        return result
+
+
+class PPStreamExecutor:
+    """
+    Executes a PPPlan over row chunks of a dataset in bounded memory. Operations needing a reduction over all rows
+    (DAGKernels.reductions) are resolved in reduction passes over the chunks, evaluating only the steps upstream of
+    the reductions, after which a final pass streams every chunk through the plan into a sink. Reductions depending on
+    other reductions are resolved in successive passes.
+    """
+    # Data size in bytes from which the plan is executed over row chunks, see PPGraph.execute_chunks
+    min_size = int(os.getenv("VB_PREPROCESSING_STREAMING_MB", 256)) * 1024 * 1024
+
+    def __init__(self, plan):
+        """
+        :param plan: PPPlan
+        """
+        self.plan = plan
+        # number of reductions upstream of each step, the pass in which a reduction step can be resolved
+        self.levels = []
+        for i, step in enumerate(plan.steps):
+            self.levels.append(max([0] + [self.levels[d] + (plan.steps[d].function in DAGKernels.reductions)
+                                          for d in step.sources if d is not None]))
+        # reduction steps of each pass, and the steps upstream of them
+        targets = [i for i, step in enumerate(plan.steps) if step.function in DAGKernels.reductions]
+        self.passes = []
+        for level in sorted(set(self.levels[i] for i in targets)):
+            level_targets = [i for i in targets if self.levels[i] == level]
+            self.passes.append((level_targets, self.ancestors(level_targets)))
+
+    def ancestors(self, targets):
+        needed = set()
+        pending = [d for i in targets for d in self.plan.steps[i].sources if d is not None]
+        while pending:
+            i = pending.pop()
+            if i not in needed:
+                needed.add(i)
+                pending.extend([d for d in self.plan.steps[i].sources if d is not None])
+        return sorted(needed)
+
+    def partials(self, chunk, p, reduced):
+        """
+        :param chunk: DataFrame row chunk of the source data
+        :param p: Reduction pass
+        :param reduced: Reduction arguments resolved by the previous passes
+        :return: Dictionary of step index to the partial reduction of the chunk, for the reduction steps of the pass
+        """
+        targets, needed = self.passes[p]
+        values = {}
+        partials = {}
+        for i in needed + targets:
+            step = self.plan.steps[i]
+            inputs = [chunk[c].to_numpy() if d is None else values[d] for c, d in zip(step.inputs, step.sources)]
+            if i in targets:
+                partials[i] = DAGKernels.reductions[step.function][0](*inputs)
+            else:
+                values[i] = step.kernel(*inputs, **reduced.get(i, {}))
+        return partials
+
+    def combine(self, partials):
+        """
+        :param partials: List of the partial reduction dictionaries of all chunks, for one pass
+        :return: Dictionary of step index to the kernel arguments of its reduction
+        """
+        return {i: DAGKernels.reductions[self.plan.steps[i].function][1]([p[i] for p in partials])
+                for i in (partials[0].keys() if partials else [])}
+
+    def reduce(self, chunks):
+        """
+        :param chunks: Function returning a new iterator over the source data as DataFrame row chunks
+        :return: Dictionary of step index to the kernel arguments of its reduction
+        """
+        reduced = {}
+        for p in range(len(self.passes)):
+            reduced.update(self.combine([self.partials(chunk, p, reduced) for chunk in chunks()]))
+        return reduced
+
+    def run(self, chunks, sink, reduced=None):
+        """
+        :param chunks: Function returning a new iterator over the source data as DataFrame row chunks
+        :param sink: Writer with write(DataFrame) and close() methods receiving the processed chunks, e.g. a
+        DatasetWriter
+        :param reduced: Optional resolved reductions, see reduce, otherwise the reductions are resolved over chunks
+        :return: The closed sink
+        """
+        reduced = self.reduce(chunks) if reduced is None else reduced
+        for chunk in chunks():
+            sink.write(self.plan.execute(chunk, workers=1, reduced=reduced))
+        sink.close()
+        return sink
+
+
+class PPDaskExecutor(PPStreamExecutor):
+    """
+    Executes a PPPlan on a partitioned Dask DataFrame. Each reduction pass maps PPStreamExecutor.partials over the
+    partitions and combines the partial reductions on the client, the plan is then mapped over the partitions with
+    the resolved reductions. Computations run on the active Dask client, if any.
+    """
+    # Data size in bytes from which tasks running on a Dask worker execute the plan across the cluster
+    min_size = int(os.getenv("VB_PREPROCESSING_DASK_MB", 1024)) * 1024 * 1024
+
+    def reduce(self, ddf):
+        """
+        :param ddf: Dask DataFrame of the source data
+        :return: Dictionary of step index to the kernel arguments of its reduction
+        """
+        reduced = {}
+        partitions = ddf.to_delayed()
+        for p in range(len(self.passes)):
+            partials = dask.compute(*[delayed(self.partials)(partition, p, reduced) for partition in partitions])
+            reduced.update(self.combine(list(partials)))
+        return reduced
+
+    def run(self, ddf, reduced=None):
+        """
+        :param ddf: Dask DataFrame of the source data, e.g. from DatasetLoader.partitions
+        :param reduced: Optional resolved reductions, see reduce, otherwise the reductions are resolved over ddf
+        :return: Dask DataFrame of the source columns followed by the output column of each requested step
+        """
+        reduced = self.reduce(ddf) if reduced is None else reduced
+        meta = self.plan.execute(ddf._meta, workers=1, reduced=reduced)
+        return ddf.map_partitions(self.plan.execute, workers=1, reduced=reduced, meta=meta)
+
+    @staticmethod
+    def write(ddf, path, columnar=True):
+        """
+        Write each partition to its own file, in parallel on the Dask workers.
+        :param ddf: Dask DataFrame
+        :param path: Directory of the partition files, shared with the workers
+        :param columnar: True to write Arrow IPC files, False to write csv
+        :return: List of the partition file paths, in partition order
+        """
+        os.makedirs(path, exist_ok=True)
+        extension = "arrow" if columnar else "csv"
+        files = [delayed(PPDaskExecutor.write_partition)(
+            partition, os.path.join(path, "part-{:05d}.{}".format(i, extension)), columnar
+        ) for i, partition in enumerate(ddf.to_delayed())]
+        return list(dask.compute(*files))
+
+    @staticmethod
+    def write_partition(df, path, columnar):
+        writer = DatasetWriter(path, columnar)
+        writer.write(df)
+        writer.close()
+        return path
+
+
 class PPNode:
     parameters = None
     function = None
@@ -101,12 +600,95 @@ class PPNode:
 
 class PPGraph:
 
-    def __init__(self, data, parameters):
+    def __init__(self, data, parameters, compiled=True, workers=None, cache_key=None, outputs=None, reductions=None):
+        """
+        :param data: Pandas DataFrame, or None to only compile the graph for a later call of execute
+        :param parameters: Pre-processing configuration, containing the graph 'nodes' and 'edges'
+        :param compiled: Execute the graph as a compiled PPPlan, otherwise apply each DAGFunctions operation in turn
+        :param workers: Number of threads executing independent branches of the compiled plan, see PPPlan.execute
+        :param cache_key: Optional (dataset id, content hash) of the data, reusing cached outputs of unchanged nodes
+        :param outputs: Optional list of the requested output columns, only their ancestor nodes are evaluated and
+        only the requested columns are added to the data. The source columns needed are in self.plan.source_columns
+        :param reductions: Optional reductions of the training data, see reductions, applied instead of reducing data
+        """
         self.graph = nx.DiGraph()
-        self.data = copy.copy(data)
         self.parameters = parameters
+        self.data = None
         self.generate_graph()
-        self.traverse()
+        if compiled:
+            self.plan = self.compile(outputs)
+            if data is not None:
+                self.execute(data, workers, cache_key, reductions)
+        else:
+            self.data = copy.copy(data)
+            self.traverse()
+
+    def execute(self, data, workers=None, cache_key=None, reductions=None):
+        """
+        Execute the compiled plan, see PPPlan.execute
+        :param reductions: Optional reductions of the training data, see reductions, otherwise the operations needing a
+        reduction over all rows are reduced over data
+        :return: DataFrame of the data and the pre-processing output columns
+        """
+        self.data = self.plan.execute(data, workers, cache_key, reduced=self.reduced(reductions))
+        return self.data
+
+    def reductions(self, data):
+        """
+        Resolve the reductions over all rows of the data, e.g. the norm of normalize, so the configuration can later be
+        applied to new rows as it was applied to this data.
+        :param data: Source Pandas DataFrame, or Dask DataFrame
+        :return: JSON serializable dictionary of the output column of each reduction step to its kernel arguments
+        """
+        if isinstance(data, dd.DataFrame):
+            reduced = PPDaskExecutor(self.plan).reduce(data)
+        else:
+            reduced = PPStreamExecutor(self.plan).reduce(lambda: [data])
+        return {self.plan.steps[i].output: {k: np.asarray(v).tolist() for k, v in args.items()}
+                for i, args in reduced.items()}
+
+    def reduced(self, reductions):
+        """
+        :param reductions: Dictionary returned by reductions, or None
+        :return: The reductions keyed by step index of the plan, as PPPlan.execute reduced, or None
+        """
+        if not reductions:
+            return None
+        return {i: reductions[step.output] for i, step in enumerate(self.plan.steps) if step.output in reductions}
+
+    def stream(self, chunks, sink, reductions=None):
+        """
+        Execute the compiled plan over row chunks in bounded memory, see PPStreamExecutor
+        :param chunks: Function returning a new iterator over the source data as DataFrame row chunks
+        :param sink: Writer receiving each processed chunk, e.g. a DatasetWriter
+        :param reductions: Optional reductions of the training data, see reductions, otherwise the operations needing a
+        reduction over all rows are reduced over the chunks
+        :return: The closed sink
+        """
+        return PPStreamExecutor(self.plan).run(chunks, sink, reduced=self.reduced(reductions))
+
+    def execute_chunks(self, chunks, reductions=None):
+        """
+        Execute the compiled plan over row chunks of the source columns, for data above PPStreamExecutor.min_size.
+        The processed chunks are collected in the columnar storage format, see DatasetWriter.
+        :param chunks: Function returning a new iterator over the source data as DataFrame row chunks
+        :param reductions: Optional reductions of the training data, see reductions
+        :return: DataFrame of the source columns and the pre-processing output columns
+        """
+        columns = self.plan.source_columns
+        sink = self.stream(lambda: (chunk[columns] for chunk in chunks()), DatasetWriter(), reductions)
+        self.data = DatasetLoader.decode(sink.getvalue())
+        return self.data
+
+    def distribute(self, ddf, reductions=None):
+        """
+        Execute the compiled plan on a partitioned Dask DataFrame, see PPDaskExecutor
+        :param ddf: Dask DataFrame of the source data, e.g. from DatasetLoader.partitions
+        :param reductions: Optional reductions of the training data, see reductions, otherwise the operations needing a
+        reduction over all rows are reduced over ddf
+        :return: Dask DataFrame of the data and the pre-processing output columns
+        """
+        return PPDaskExecutor(self.plan).run(ddf, reduced=self.reduced(reductions))
 
     def generate_graph(self):
         for k, v in self.parameters["nodes"].items():
@@ -119,6 +701,21 @@ class PPGraph:
         # nx.draw_networkx_labels(self.graph, pos, font_size=20)
         # plt.show()
 
+    def compile(self, outputs=None, fuse=True):
+        """
+        :param outputs: Optional list of requested output columns, the plan is pruned to the nodes they depend on
+        :param fuse: Merge chains of operations with unused intermediate results into fused steps, see PPPlan.fuse
+        :return: PPPlan of the graph nodes in topological order
+        """
+        steps = []
+        for o in nx.topological_sort(self.graph):
+            n = self.graph.nodes[o]['data']
+            steps.append(PPStep(o, n.function, n.parameters))
+        plan = PPPlan(steps, list(self.graph.edges))
+        if outputs is not None:
+            plan = plan.prune(outputs)
+        return plan.fuse() if fuse else plan
+
     def traverse(self):
         order = list(nx.topological_sort(self.graph))
         for o in order:
@@ -0,0 +1,84 @@
+from sklearn.model_selection import ParameterGrid, cross_val_score, check_cv
+from sklearn.model_selection._search import BaseSearchCV
+from sklearn.base import clone
+import numpy as np
+import time
+import logging
+
+
+logger = logging.getLogger("vb_dask")
+
+
+class HalvingGridSearchCV(BaseSearchCV):
+    """
+    Successive halving over a parameter grid, using cross-validation splits as the resource. Candidates are first
+    scored on the first split, then on factor times more splits each round while only the best 1 / factor of the
+    candidates are kept, and the remaining candidates are evaluated on all splits as in GridSearchCV. Fits of the
+    automated pipeline cost about the same on subsampled rows, so splits rather than rows are halved. cv_results_
+    holds the evaluations of the final round, n_candidates_ the number of candidates of each round.
+    """
+    def __init__(self, estimator, param_grid, *, factor=3, scoring=None, n_jobs=None, refit=True, cv=None, verbose=0,
+                 pre_dispatch='2*n_jobs', error_score=np.nan, return_train_score=False):
+        super().__init__(estimator=estimator, scoring=scoring, n_jobs=n_jobs, refit=refit, cv=cv, verbose=verbose,
+                         pre_dispatch=pre_dispatch, error_score=error_score, return_train_score=return_train_score)
+        self.param_grid = param_grid
+        self.factor = factor
+
+    def fit(self, X, y=None, **fit_params):
+        # the training data is needed by _run_search for the pruning rounds
+        self._data = (X, y)
+        try:
+            return super().fit(X, y, **fit_params)
+        finally:
+            del self._data
+
+    def _run_search(self, evaluate_candidates):
+        X, y = self._data
+        candidates = list(ParameterGrid(self.param_grid))
+        splits = list(check_cv(self.cv).split(X, y))
+        self.n_candidates_ = []
+        n = 1
+        while n < len(splits) and len(candidates) > self.factor:
+            scores = [np.mean(cross_val_score(clone(self.estimator).set_params(**p), X, y, cv=splits[:n],
+                                              scoring=self.scoring, n_jobs=self.n_jobs, error_score=np.nan))
+                      for p in candidates]
+            self.n_candidates_.append(len(candidates))
+            keep = int(np.ceil(len(candidates) / self.factor))
+            best = np.argsort(-np.nan_to_num(scores, nan=-np.inf), kind='stable')[:keep]
+            candidates = [candidates[i] for i in sorted(best)]
+            n *= self.factor
+        self.n_candidates_.append(len(candidates))
+        evaluate_candidates(candidates)
+
+
+class BudgetGridSearchCV(BaseSearchCV):
+    """
+    Anytime search over a parameter grid within a time budget. Candidates are evaluated as in GridSearchCV in a
+    seeded random order, in batches of batch_size, no new batch is started once the deadline has passed, and the best
+    candidate evaluated so far is selected. At least one batch is always evaluated. The budget is a soft limit: a
+    batch started before the deadline runs to completion, and the refit of the best candidate is not included.
+    """
+    def __init__(self, estimator, param_grid, *, max_seconds=60., deadline=None, batch_size=1, random_state=None,
+                 scoring=None, n_jobs=None, refit=True, cv=None, verbose=0, pre_dispatch='2*n_jobs',
+                 error_score=np.nan, return_train_score=False):
+        """
+        :param max_seconds: Time budget of the search, counted from the start of fit, used if deadline is None
+        :param deadline: Optional absolute time.time() deadline, shared by searches fitted within a common budget
+        """
+        super().__init__(estimator=estimator, scoring=scoring, n_jobs=n_jobs, refit=refit, cv=cv, verbose=verbose,
+                         pre_dispatch=pre_dispatch, error_score=error_score, return_train_score=return_train_score)
+        self.param_grid = param_grid
+        self.max_seconds = max_seconds
+        self.deadline = deadline
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def _run_search(self, evaluate_candidates):
+        deadline = self.deadline if self.deadline is not None else time.time() + self.max_seconds
+        candidates = list(ParameterGrid(self.param_grid))
+        order = np.random.RandomState(self.random_state).permutation(len(candidates))
+        for i in range(0, len(candidates), self.batch_size):
+            if i > 0 and time.time() > deadline:
+                logger.info("Search time budget reached after {} of {} candidates".format(i, len(candidates)))
+                break
+            evaluate_candidates([candidates[j] for j in order[i:i + self.batch_size]])
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct value count estimate for each column of a stream of 2-D float arrays, relative standard error
+    of about 1.04 / sqrt(2 ** precision). NaN values are counted as distinct values, matching numpy.unique.
+    """
+    def __init__(self, columns, precision=12):
+        self.precision = precision
+        self.m = 2 ** precision
+        self.registers = np.zeros((self.m, columns), dtype=np.uint8)
+        self.nan_count = np.zeros(columns, dtype=np.int64)
+
+    @staticmethod
+    def hash(values):
+        """
+        SplitMix64 finalizer of the float64 bit patterns.
+        :param values: float array
+        :return: uint64 array of hashes
+        """
+        h = (values + 0.).view(np.uint64)       # + 0. maps -0. to 0.
+        with np.errstate(over='ignore'):
+            h = h ^ (h >> np.uint64(30))
+            h = h * np.uint64(0xbf58476d1ce4e5b9)
+            h = h ^ (h >> np.uint64(27))
+            h = h * np.uint64(0x94d049bb133111eb)
+            h = h ^ (h >> np.uint64(31))
+        return h
+
+    @staticmethod
+    def bit_length(x):
+        n = np.zeros(x.shape, dtype=np.uint8)
+        for s in (32, 16, 8, 4, 2, 1):
+            shift = x >= (np.uint64(1) << np.uint64(s))
+            n[shift] += s
+            x = np.where(shift, x >> np.uint64(s), x)
+        return n + (x > 0)
+
+    def update(self, values):
+        """
+        :param values: 2-D float array, rows x columns
+        """
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        nan = np.isnan(values)
+        self.nan_count += nan.sum(axis=0)
+        h = self.hash(values)
+        bits = 64 - self.precision
+        index = (h >> np.uint64(bits)).astype(np.int64)
+        rank = (bits + 1 - self.bit_length(h & np.uint64((1 << bits) - 1))).astype(np.uint8)
+        rank[nan] = 0
+        flat = (index * values.shape[1] + np.arange(values.shape[1])).ravel()
+        np.maximum.at(self.registers.reshape(-1), flat, rank.ravel())
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        self.nan_count += other.nan_count
+
+    def estimate(self):
+        """
+        :return: 1-D array of estimated distinct value counts
+        """
+        alpha = 0.7213 / (1. + 1.079 / self.m)
+        estimate = alpha * self.m ** 2 / np.sum(np.exp2(-self.registers.astype(np.float64)), axis=0)
+        zeros = np.count_nonzero(self.registers == 0, axis=0)
+        with np.errstate(divide='ignore'):
+            linear = self.m * np.log(self.m / zeros)
+        estimate = np.where((estimate <= 2.5 * self.m) & (zeros > 0), linear, estimate)
+        return np.round(estimate).astype(np.int64) + self.nan_count
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile estimate for each column of a stream of 2-D float arrays. Each level holds up to capacity
+    sorted rows of weight 2 ** level and is compacted into the next level by keeping every other row, giving a rank
+    error of roughly log2(n / capacity) / capacity. Columns share the level layout, so compactions are vectorized.
+    NaN values are counted per column, the quantiles of columns containing NaN are NaN, matching numpy.quantile.
+    """
+    def __init__(self, columns, capacity=256, seed=42):
+        self.columns = columns
+        self.capacity = capacity
+        self.levels = []
+        self.nan_count = np.zeros(columns, dtype=np.int64)
+        self.rng = np.random.RandomState(seed)
+
+    def update(self, values):
+        """
+        :param values: 2-D float array, rows x columns
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1, self.columns)
+        self.nan_count += np.isnan(values).sum(axis=0)
+        self.insert(values, 0)
+
+    def insert(self, values, level):
+        """
+        Add rows to a level, compacting it into the next level when full.
+        :param values: 2-D float array, rows x columns
+        :param level: Level of the rows, rows have a weight of 2 ** level
+        """
+        while len(self.levels) <= level:
+            self.levels.append(np.empty((0, self.columns)))
+        rows = np.concatenate([self.levels[level], values])
+        if rows.shape[0] < self.capacity:
+            self.levels[level] = rows
+            return
+        rows.sort(axis=0)
+        even = rows.shape[0] - rows.shape[0] % 2
+        self.levels[level] = rows[even:]
+        self.insert(rows[self.rng.randint(2):even:2], level + 1)
+
+    def merge(self, other):
+        for level, rows in enumerate(other.levels):
+            self.insert(rows, level)
+        self.nan_count += other.nan_count
+
+    def quantile(self, q):
+        """
+        :param q: Quantile in [0, 1]
+        :return: 1-D array of estimated quantiles, NaN for columns containing NaN
+        """
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(rows.shape[0], 2. ** level) for level, rows in enumerate(self.levels)])
+        order = np.argsort(values, axis=0)
+        values = np.take_along_axis(values, order, axis=0)
+        cumulative = np.cumsum(weights[order], axis=0)
+        index = np.argmax(cumulative >= q * cumulative[-1], axis=0)
+        result = values[index, np.arange(self.columns)]
+        result[self.nan_count > 0] = np.nan
+        return result
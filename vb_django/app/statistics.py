@@ -1,15 +1,215 @@
 from sklearn.linear_model import LinearRegression
+from vb_django.app.dataset_loader import DatasetLoader
+from vb_django.app.sketches import HyperLogLog, QuantileSketch
 import sklearn.metrics as skm
 import numpy as np
 import scipy.stats as scs
+import scipy.special as scsp
+from concurrent.futures import ThreadPoolExecutor
 import warnings
+import json
+import os
 
 
 class DatasetStatistics:
-    def __init__(self, dataset):
+    # Incremented when the calculated statistics change, invalidating statistics stored with datasets
+    version = 1
+    # Number of columns evaluated together, bounds the temporary arrays to rows x block_size
+    block_size = 256
+    # Column count from which column blocks are evaluated in parallel, and the default number of parallel workers
+    parallel_columns = int(os.getenv("VB_STATS_PARALLEL_COLUMNS", 1024))
+    workers = int(os.getenv("VB_STATS_WORKERS", min(4, os.cpu_count() or 1)))
+    # Stored dataset size from which statistics are calculated from row chunks, see StreamingDatasetStatistics
+    streaming_size = int(os.getenv("VB_STATS_STREAMING_MB", 256)) * 1024 * 1024
+
+    def __init__(self, dataset, workers=None):
+        """
+        :param dataset: Pandas DataFrame
+        :param workers: Number of parallel workers, defaults to DatasetStatistics.workers
+        """
         self.dataset = dataset
+        self.workers = DatasetStatistics.workers if workers is None else workers
 
-    def calculate_statistics(self, response):
+    @staticmethod
+    def get(dataset, response, data=None, save=True, streaming=None):
+        """
+        Get the statistics of a Dataset, the calculated statistics are stored with the dataset and only recalculated
+        when the dataset content, the response column or the statistics version changes.
+        :param dataset: Dataset model instance
+        :param response: Name of the response column
+        :param data: Optional DataFrame of the already loaded dataset
+        :param save: Store recalculated statistics with the dataset
+        :param streaming: Calculate the statistics from row chunks, by default for datasets above streaming_size
+        :return: Dictionary of statistics for each column
+        """
+        content_hash = DatasetLoader.content_hash(dataset.data)
+        if dataset.statistics:
+            stored = json.loads(dataset.statistics)
+            if stored["version"] == DatasetStatistics.version and stored["content_hash"] == content_hash \
+                    and stored["response"] == response:
+                return stored["statistics"]
+        if streaming is None:
+            streaming = len(dataset.data) > DatasetStatistics.streaming_size
+        if streaming:
+            stats = StreamingDatasetStatistics(lambda: DatasetLoader.iter_chunks(dataset.data)).calculate_statistics(
+                response)
+        else:
+            data = DatasetLoader.load(dataset) if data is None else data
+            stats = DatasetStatistics(data).calculate_statistics(response)
+        dataset.statistics = json.dumps({
+            "version": DatasetStatistics.version,
+            "content_hash": content_hash,
+            "response": response,
+            "statistics": stats
+        }, default=lambda v: v.item())
+        if save:
+            dataset.save(update_fields=["statistics"])
+        return stats
+
+    def calculate_statistics(self, response, parallel=None):
+        """
+        Calculate the statistics of every column, vectorized over blocks of columns.
+        :param response: Name of the response column, each column's A-D statistic is calculated for the residuals of
+        the simple linear regression of the response on that column
+        :param parallel: Evaluate the column blocks on a thread pool of self.workers threads, by default only for
+        datasets with at least DatasetStatistics.parallel_columns columns. The block computations run in numpy and
+        scipy routines that release the GIL, so threads avoid copying the blocks to worker processes.
+        :return: Dictionary of statistics for each column
+        """
+        warnings.simplefilter('ignore')
+        names = self.dataset.columns.tolist()
+        r_data = self.dataset[response].to_numpy(dtype=np.float64).flatten()
+        blocks = [(i, min(i + DatasetStatistics.block_size, len(names)))
+                  for i in range(0, len(names), DatasetStatistics.block_size)]
+
+        def evaluate(block):
+            values = self.dataset.iloc[:, block[0]:block[1]].to_numpy(dtype=np.float64)
+            return DatasetStatistics.block_statistics(values, r_data)
+
+        if parallel is None:
+            parallel = len(names) >= DatasetStatistics.parallel_columns
+        if parallel and self.workers > 1 and len(blocks) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(evaluate, blocks))
+        else:
+            results = map(evaluate, blocks)
+        stats = {}
+        for block, result in zip(blocks, results):
+            stats.update(DatasetStatistics.format_statistics(names[block[0]:block[1]], result))
+        return stats
+
+    @staticmethod
+    def block_statistics(values, r_data):
+        """
+        Calculate the statistics of a 2-D array of columns with single reductions over the rows.
+        :param values: 2-D float array, rows x columns
+        :param r_data: 1-D float array of the response values
+        :return: Dictionary of 1-D arrays with one value per column
+        """
+        n = values.shape[0]
+        with np.errstate(all='ignore'):
+            mean = values.mean(axis=0)
+            centered = values - mean
+            centered_sq = centered * centered
+            m2 = centered_sq.mean(axis=0)
+            m3 = (centered_sq * centered).mean(axis=0)
+            m4 = (centered_sq * centered_sq).mean(axis=0)
+            del centered_sq
+
+            # closed form simple regression of the response on each column, constant columns have a zero slope
+            cov = centered.T.dot(r_data - r_data.mean()) / n
+            del centered
+            slope = np.where(m2 > 0, cov / m2, 0.)
+            intercept = r_data.mean() - slope * mean
+            residuals = values - (values * slope + intercept)
+            ad = DatasetStatistics.anderson_darling(residuals)
+            del residuals
+
+            ordered = np.sort(values, axis=0)
+            median = 0.5 * (ordered[(n - 1) // 2] + ordered[n // 2])
+            median[np.isnan(ordered[-1])] = np.nan
+            unique = 1 + np.count_nonzero(ordered[1:] != ordered[:-1], axis=0)
+            del ordered
+            maximum = values.max(axis=0)
+            minimum = values.min(axis=0)
+            return {
+                "max": maximum,
+                "min": minimum,
+                "mean": mean,
+                "unique": unique,
+                "zeros": n - np.count_nonzero(values, axis=0),
+                "median": median,
+                "range": maximum - minimum,
+                "ad": ad,
+                "ad_p": DatasetStatistics.anderson_darling_p(ad),
+                "std": np.sqrt(m2),
+                "var": m2,
+                "kurtosis": np.where(m2 == 0, 0., m4 / m2 ** 2) - 3.,
+                "skew": np.where(m2 == 0, 0., m3 / m2 ** 1.5),
+                "n": np.full(values.shape[1], n)
+            }
+
+    @staticmethod
+    def format_statistics(names, block):
+        """
+        Convert the per column arrays of block_statistics into the statistics dictionary of each column.
+        :param names: Column names
+        :param block: Dictionary returned by block_statistics
+        :return: Dictionary of statistics for each column
+        """
+        stats = {}
+        for i, name in enumerate(names):
+            stats[name] = {
+                "Variable Name": name,
+                "Row Count": int(block["n"][i]),
+                "Maximum Value": block["max"][i],
+                "Minimum Value": block["min"][i],
+                "Average Value": block["mean"][i],
+                "Unique Values": int(block["unique"][i]),
+                "Zero Count": int(block["zeros"][i]),
+                "Median Value": block["median"][i],
+                "Data Range": block["range"][i],
+                "A-D Statistics": 0 if np.isnan(block["ad"][i]) else block["ad"][i],
+                "A-D Stat P-Value": 0 if np.isnan(block["ad_p"][i]) else block["ad_p"][i],
+                "Mean Value": block["mean"][i],
+                "Standard Deviation": block["std"][i],
+                "Variance": block["var"][i],
+                "Kurtosis": block["kurtosis"][i],
+                "Skewness": block["skew"][i]
+            }
+        return stats
+
+    @staticmethod
+    def anderson_darling(values):
+        """
+        Anderson-Darling test statistic for normality of each column, equivalent to scipy.stats.anderson(x)[0].
+        :param values: 2-D float array, rows x columns
+        :return: 1-D array of A-D statistics
+        """
+        n = values.shape[0]
+        with np.errstate(all='ignore'):
+            w = (np.sort(values, axis=0) - values.mean(axis=0)) / values.std(axis=0, ddof=1)
+            weights = ((2. * np.arange(1, n + 1) - 1.) / n).reshape(-1, 1)
+            return -n - np.sum(weights * (scsp.log_ndtr(w) + scsp.log_ndtr(-w[::-1])), axis=0)
+
+    @staticmethod
+    def anderson_darling_p(ad):
+        """
+        Approximate p-values of Anderson-Darling statistics.
+        :param ad: 1-D array of A-D statistics
+        :return: 1-D array of p-values
+        """
+        with np.errstate(all='ignore'):
+            small = 1. - np.exp(-1.2337141 / ad) / np.sqrt(ad) * (2.00012 + (
+                    .247105 - (.0649821 - (.0347962 - (.011672 - .00168691 * ad) * ad) * ad) * ad) * ad)
+            large = 1. - np.exp(-1. * np.exp(
+                1.0776 - (2.30695 - (.43424 - (.082433 - (.008056 - .0003146 * ad) * ad) * ad) * ad) * ad))
+            return np.where(ad < 2, small, large)
+
+    def calculate_statistics_per_column(self, response):
+        """
+        Reference implementation of calculate_statistics, fitting and testing one column at a time.
+        """
         warnings.simplefilter('ignore')
         stats = {}
         r_data = self.dataset[response].to_numpy().flatten()
@@ -47,6 +247,158 @@ class DatasetStatistics:
         return stats
 
 
+class StreamingDatasetStatistics:
+    """
+    Calculates the statistics of DatasetStatistics.calculate_statistics from row chunks of a dataset, holding only per
+    column accumulators in memory. Moments, extremes, zero counts and the regression sums are exact. Median and unique
+    value counts are estimated with mergeable sketches, and the A-D statistic from a histogram of the residual normal
+    CDF values collected in a second pass over the chunks.
+    """
+    def __init__(self, chunks, sketch_capacity=256, hll_precision=12, ad_bins=2048):
+        """
+        :param chunks: Function returning a new iterator over the dataset as DataFrame row chunks
+        :param sketch_capacity: Rows per level of the median sketch
+        :param hll_precision: HyperLogLog precision of the unique value counts
+        :param ad_bins: Number of CDF histogram bins of the A-D statistic
+        """
+        self.chunks = chunks
+        self.sketch_capacity = sketch_capacity
+        self.hll_precision = hll_precision
+        self.ad_bins = ad_bins
+
+    def calculate_statistics(self, response):
+        """
+        :param response: Name of the response column
+        :return: Dictionary of statistics for each column
+        """
+        warnings.simplefilter('ignore')
+        names = None
+        for chunk in self.chunks():
+            if names is None:
+                names = chunk.columns.tolist()
+                self.initialize(len(names))
+            self.update(chunk.to_numpy(dtype=np.float64), chunk[response].to_numpy(dtype=np.float64).flatten())
+        if names is None:
+            return {}
+        n = self.n
+        with np.errstate(all='ignore'):
+            m2 = self.m2 / n
+            slope = np.where(m2 > 0, (self.cr / n) / m2, 0.)
+            intercept = self.r_mean - slope * self.mean
+            ad = self.anderson_darling(response, slope, intercept)
+            block = {
+                "max": self.maximum,
+                "min": self.minimum,
+                "mean": self.mean,
+                "unique": self.unique.estimate(),
+                "zeros": self.zeros,
+                "median": self.quantiles.quantile(0.5),
+                "range": self.maximum - self.minimum,
+                "ad": ad,
+                "ad_p": DatasetStatistics.anderson_darling_p(ad),
+                "std": np.sqrt(m2),
+                "var": m2,
+                "kurtosis": np.where(m2 == 0, 0., (self.m4 / n) / m2 ** 2) - 3.,
+                "skew": np.where(m2 == 0, 0., (self.m3 / n) / m2 ** 1.5),
+                "n": np.full(len(names), n)
+            }
+        return DatasetStatistics.format_statistics(names, block)
+
+    def initialize(self, columns):
+        self.n = 0
+        self.mean = np.zeros(columns)
+        self.m2 = np.zeros(columns)
+        self.m3 = np.zeros(columns)
+        self.m4 = np.zeros(columns)
+        self.r_mean = 0.
+        self.cr = np.zeros(columns)
+        self.minimum = np.full(columns, np.inf)
+        self.maximum = np.full(columns, -np.inf)
+        self.zeros = np.zeros(columns, dtype=np.int64)
+        self.unique = HyperLogLog(columns, self.hll_precision)
+        self.quantiles = QuantileSketch(columns, self.sketch_capacity)
+
+    def update(self, values, r_data):
+        """
+        Merge the central moment sums and the column/response co-moment sums of a chunk (Pebay's pairwise update).
+        :param values: 2-D float array of the chunk, rows x columns
+        :param r_data: 1-D float array of the chunk's response values
+        """
+        nb = values.shape[0]
+        if nb == 0:
+            return
+        with np.errstate(all='ignore'):
+            mean_b = values.mean(axis=0)
+            centered = values - mean_b
+            centered_sq = centered * centered
+            m2_b = centered_sq.sum(axis=0)
+            m3_b = (centered_sq * centered).sum(axis=0)
+            m4_b = (centered_sq * centered_sq).sum(axis=0)
+            r_mean_b = r_data.mean()
+            cr_b = centered.T.dot(r_data - r_mean_b)
+
+            na = self.n
+            n = na + nb
+            delta = mean_b - self.mean
+            delta_r = r_mean_b - self.r_mean
+            self.m4 += m4_b + delta ** 4 * na * nb * (na * na - na * nb + nb * nb) / n ** 3 + \
+                6. * delta ** 2 * (na * na * m2_b + nb * nb * self.m2) / n ** 2 + \
+                4. * delta * (na * m3_b - nb * self.m3) / n
+            self.m3 += m3_b + delta ** 3 * na * nb * (na - nb) / n ** 2 + 3. * delta * (na * m2_b - nb * self.m2) / n
+            self.m2 += m2_b + delta ** 2 * na * nb / n
+            self.cr += cr_b + delta * delta_r * na * nb / n
+            self.mean += delta * nb / n
+            self.r_mean += delta_r * nb / n
+            self.n = n
+        self.minimum = np.minimum(self.minimum, values.min(axis=0))
+        self.maximum = np.maximum(self.maximum, values.max(axis=0))
+        self.zeros += nb - np.count_nonzero(values, axis=0)
+        self.unique.update(values)
+        self.quantiles.update(values)
+
+    def anderson_darling(self, response, slope, intercept):
+        """
+        A-D statistic of the regression residuals from a second pass over the chunks. The residual mean and standard
+        deviation follow from the first pass, the residuals are counted in bins of their normal CDF value and the
+        statistic is integrated, A2 = n * integral((Fn(u) - u)^2 / (u(1 - u)) du), with Fn exact at the bin edges and
+        linear within each bin.
+        :param response: Name of the response column
+        :param slope: 1-D array of regression slopes
+        :param intercept: 1-D array of regression intercepts
+        :return: 1-D array of A-D statistics
+        """
+        n = self.n
+        k = slope.shape[0]
+        bins = self.ad_bins
+        counts = np.zeros(bins * k)
+        has_nan = np.zeros(k, dtype=bool)
+        res_mean = (1. - slope) * self.mean - intercept
+        res_std = np.abs(1. - slope) * np.sqrt(self.m2 / (n - 1))
+        for chunk in self.chunks():
+            values = chunk.to_numpy(dtype=np.float64)
+            with np.errstate(all='ignore'):
+                u = scsp.ndtr(((values - (values * slope + intercept)) - res_mean) / res_std)
+            valid = ~np.isnan(u)
+            has_nan |= np.isnan(values).any(axis=0)
+            index = (np.minimum(u[valid] * bins, bins - 1).astype(np.int64) * k +
+                     np.broadcast_to(np.arange(k), values.shape)[valid])
+            counts += np.bincount(index, minlength=bins * k)
+        edf = np.concatenate([np.zeros((1, k)), np.cumsum(counts.reshape(bins, k), axis=0)]) / n
+        edges = np.linspace(0., 1., bins + 1).reshape(-1, 1)
+        u0, u1 = edges[:-1], edges[1:]
+        e0, e1 = edf[:-1] - u0, edf[1:] - u1
+        slope_e = (e1 - e0) / (u1 - u0)
+        # Fn(u) - u = a + t u within a bin, the integral is a^2 ln(u1/u0) + (a+t)^2 ln((1-u0)/(1-u1)) - t^2 (u1-u0)
+        at_zero = e0 - slope_e * u0
+        at_one = e1 + slope_e * (1. - u1)
+        with np.errstate(all='ignore'):
+            ad = n * np.sum(
+                np.where(at_zero == 0, 0., at_zero ** 2 * np.log(u1 / u0)) +
+                np.where(at_one == 0, 0., at_one ** 2 * np.log((1. - u0) / (1. - u1))) -
+                slope_e ** 2 * (u1 - u0), axis=0)
+        ad[has_nan | ~(res_std > 0)] = np.nan
+        return ad
+
 def evaluate_results(predicted, actual):
     metrics = {
         "accuracy": skm.accuracy_score(actual, predicted),
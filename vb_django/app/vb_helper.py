@@ -1,11 +1,154 @@
 import numpy as np
-from sklearn.linear_model import ElasticNetCV, Lars
+from sklearn.linear_model import ElasticNetCV, Lars, enet_path, lars_path_gram
+from sklearn.model_selection import KFold
 from sklearn.base import BaseEstimator, TransformerMixin
+from vb_django.app.cache import LRUCache
+import joblib
+import weakref
+import os
+
+
+# Per process cache of fitted pipeline steps, keyed by (PipelineMemory namespace, function, hash of the arguments)
+pipeline_cache = LRUCache(
+    max_size=int(os.getenv("VB_PIPELINE_CACHE_MB", 512)) * 1024 * 1024,
+    sizeof=lambda v: sum(getattr(a, "nbytes", 0) for a in (v if isinstance(v, tuple) else (v,))) + 1024
+)
+
+# Per process cache of LARS coefficient paths, keyed by (namespace, fitted data), see ShrinkBigKTransformer.lars_path
+lars_path_cache = LRUCache(
+    max_size=int(os.getenv("VB_LARS_CACHE_MB", 128)) * 1024 * 1024,
+    sizeof=lambda v: v[1].nbytes
+)
+
+# Per process cache of GramStatistics, keyed by (namespace, data)
+gram_cache = LRUCache(
+    max_size=int(os.getenv("VB_GRAM_CACHE_MB", 256)) * 1024 * 1024,
+    sizeof=lambda v: v[1].nbytes
+)
+
+
+def cached_by_data(cache, X, key, compute, namespace=None):
+    """
+    Get or compute a value derived from the data X. Entries are keyed by the namespace and the hash of X, and by the
+    identity of X so arrays shared between pipeline fits, e.g. PipelineMemory outputs, are found without hashing them
+    again.
+    :param cache: LRUCache
+    :param X: Array the value is derived from
+    :param key: Tuple of the other arguments of the value
+    :param compute: Function computing the value
+    :param namespace: Optional namespace of the entries, e.g. the PipelineMemory namespace of a task, see clear_caches
+    :return: The cached or computed value
+    """
+    entry = cache.get((namespace, id(X)) + key)
+    if entry is not None and entry[0]() is X:
+        return entry[1]
+    data_key = (namespace, joblib.hash(X)) + key
+    entry = cache.get(data_key)
+    if entry is None:
+        entry = (None, compute())
+        cache.put(data_key, entry)
+    cache.put((namespace, id(X)) + key, (weakref.ref(X), entry[1]))
+    return entry[1]
+
+
+def clear_caches(namespace=None):
+    """
+    Clear the pipeline, LARS path and Gram cache entries of a task namespace in this process, or all of them.
+    :param namespace: Optional PipelineMemory namespace of the task
+    """
+    for cache in (pipeline_cache, lars_path_cache, gram_cache):
+        if namespace is None:
+            cache.clear()
+        else:
+            cache.invalidate(lambda k: k[0] == namespace)
+
+
+class PipelineMemory:
+    """
+    In-memory replacement of joblib.Memory for the memory option of a Pipeline. The fitted transformer and transformed
+    data of each step are cached in the per process pipeline_cache, keyed by the step parameters and input data, so
+    grid points and folds sharing a pipeline prefix fit it once. Cached objects are shared between pipelines and must
+    not be modified. Entries are grouped by namespace, clear removes the entries of a task.
+    """
+    def __init__(self, namespace):
+        self.namespace = namespace
+
+    def cache(self, func, ignore=None):
+        def cached(*args, **kwargs):
+            hashed = {k: v for k, v in kwargs.items() if k not in (ignore or [])}
+            key = (self.namespace, func.__qualname__, joblib.hash((args, hashed)))
+            result = pipeline_cache.get(key)
+            if result is None:
+                result = func(*args, **kwargs)
+                pipeline_cache.put(key, result)
+            return result
+        return cached
+
+    def clear(self):
+        pipeline_cache.invalidate(lambda k: k[0] == self.namespace)
+
+
+class GramStatistics:
+    """
+    X^T X statistics of a data matrix over the contiguous row folds of KFold(n_folds): the Gram matrix and column
+    sums of each fold, of the data shifted by its column means for accuracy. The centered Gram matrix of any union of
+    folds is combined from them without another pass over the data, so the Lars and elastic-net selectors and their
+    cross-validation folds share a single X^T X computation per fold data.
+    """
+    folds = 5
+
+    def __init__(self, X, n_folds=None):
+        X = np.asarray(X, dtype=np.float64)
+        n_folds = n_folds if n_folds else GramStatistics.folds
+        self.shift = X.mean(axis=0)
+        self.tests = [slice(0, X.shape[0])]
+        if X.shape[0] >= n_folds:
+            self.tests = [slice(test[0], test[-1] + 1) for _, test in KFold(n_folds).split(X)]
+        self.counts = np.array([t.stop - t.start for t in self.tests])
+        self.grams = np.empty((len(self.tests), X.shape[1], X.shape[1]))
+        self.sums = np.empty((len(self.tests), X.shape[1]))
+        for f, test in enumerate(self.tests):
+            x = X[test] - self.shift
+            self.grams[f] = x.T @ x
+            self.sums[f] = x.sum(axis=0)
+
+    @property
+    def nbytes(self):
+        return self.grams.nbytes + self.sums.nbytes
+
+    @staticmethod
+    def get(X, namespace=None):
+        """
+        :param X: 2-D array
+        :param namespace: Optional namespace of the cache entry, see cached_by_data
+        :return: GramStatistics of X, cached per process
+        """
+        return cached_by_data(gram_cache, X, ("gram", GramStatistics.folds), lambda: GramStatistics(X),
+                              namespace=namespace)
+
+    def centered(self, folds=None):
+        """
+        :param folds: Indices of the folds, defaults to all folds
+        :return: Row count, column means and centered Gram matrix of the union of the folds
+        """
+        folds = np.arange(len(self.tests)) if folds is None else np.asarray(folds)
+        n = self.counts[folds].sum()
+        mean = self.sums[folds].sum(axis=0) / n
+        gram = self.grams[folds].sum(axis=0) - n * np.outer(mean, mean)
+        return n, mean + self.shift, gram
 
 
 class ShrinkBigKTransformer(BaseEstimator, TransformerMixin):
-    def __init__(self, max_k=500, selector=None):
+    """
+    Selects the columns with positive coefficients of a Lars fit limited to max_k non-zero coefficients, or of an
+    elastic-net fit. The 'lars-path' selector computes the full LARS path of the data once and selects the columns of
+    its step max_k, which is the Lars fit for that max_k, so a grid over max_k fits a single path per fold. The
+    'lars-path' and 'elastic-net-gram' selectors work from the cached GramStatistics of the data, their cache entries
+    are grouped by namespace, e.g. the PipelineMemory namespace of a task, see clear_caches.
+    """
+    def __init__(self, max_k=500, selector=None, namespace=None):
         self.max_k = max_k
+        self.namespace = namespace
         if selector is None:
             self.selector = 'Lars'
         else:
@@ -13,6 +156,13 @@ class ShrinkBigKTransformer(BaseEstimator, TransformerMixin):
 
     def fit(self, X, y):
         assert not y is None, f'y:{y}'
+        if self.selector == 'lars-path':
+            coefs = self.lars_path(X, y, self.namespace)
+            self.col_select = np.arange(X.shape[1])[coefs[:, min(self.max_k, coefs.shape[1] - 1)] > 0]
+            return self
+        if self.selector == 'elastic-net-gram':
+            self.col_select = np.arange(X.shape[1])[self.elastic_net(X, y, namespace=self.namespace) > 0]
+            return self
         if self.selector == 'Lars':
             selector = Lars(fit_intercept=1, normalize=1, n_nonzero_coefs=self.max_k)
         elif self.selector == 'elastic-net':
@@ -25,6 +175,128 @@ class ShrinkBigKTransformer(BaseEstimator, TransformerMixin):
     def transform(self, X):
         return X[:, self.col_select]
 
+    @staticmethod
+    def lars_path(X, y, namespace=None):
+        """
+        LARS path of the centered and normalized data, matching Lars(fit_intercept=1, normalize=1), cached per data.
+        :param X: 2-D array
+        :param y: 1-D array
+        :param namespace: Optional namespace of the cache entries
+        :return: Coefficient path of the normalized data, column j holding the coefficients after j steps
+        """
+        def compute():
+            n, mean, gram = GramStatistics.get(X, namespace).centered()
+            scale = np.sqrt(np.diag(gram)).copy()
+            scale[scale == 0] = 1.
+            yc = np.asarray(y, dtype=np.float64) - np.mean(y)
+            xy = (np.asarray(X, dtype=np.float64).T @ yc) / scale
+            _, _, coefs = lars_path_gram(xy, gram / np.outer(scale, scale), n_samples=n, method='lar',
+                                         max_iter=gram.shape[0])
+            return coefs
+        return cached_by_data(lars_path_cache, X, (joblib.hash(y),), compute, namespace=namespace)
+
+    @staticmethod
+    def elastic_net(X, y, l1_ratio=0.5, eps=1e-3, n_alphas=100, max_iter=1000, tol=1e-4, namespace=None):
+        """
+        Coefficients of ElasticNetCV(), cross-validated over the folds of GramStatistics. The Gram matrix and X^T y of
+        each training set and the squared errors of each test fold are combined from the cached fold statistics, so
+        the cost after the first fit on a fold data is independent of the row count.
+        :param X: 2-D array
+        :param y: 1-D array
+        :param namespace: Optional namespace of the cache entries
+        :return: Coefficients of the elastic-net fit of the selected alpha on all rows
+        """
+        stats = GramStatistics.get(X, namespace)
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64).ravel()
+        y = y - y.mean()
+        k = X.shape[1]
+        # X^T y and y sums of each fold, of the shifted data
+        xy = np.array([X[t].T @ y[t] - stats.shift * y[t].sum() for t in stats.tests])
+        y_sums = np.array([y[t].sum() for t in stats.tests])
+        folds = np.arange(len(stats.tests))
+
+        def path(train, alphas):
+            n_t, mean_t, gram_t = stats.centered(train)
+            y_mean = y_sums[train].sum() / n_t
+            xy_t = xy[train].sum(axis=0) - y_mean * stats.sums[train].sum(axis=0)
+            y_t = np.concatenate([y[stats.tests[f]] for f in train]) - y_mean
+            # with a precomputed Gram matrix and check_input=False enet_path only reads the shape of X
+            _, coefs, _ = enet_path(np.broadcast_to(0., (n_t, k)), y_t, l1_ratio=l1_ratio, alphas=alphas,
+                                    precompute=gram_t, Xy=xy_t, check_input=False, max_iter=max_iter, tol=tol)
+            return coefs, mean_t, y_mean, xy_t
+
+        n = stats.counts.sum()
+        _, _, _, xy_all = path(folds, [1.])
+        alpha_max = np.max(np.abs(xy_all)) / (n * l1_ratio)
+        if alpha_max <= np.finfo(float).resolution:
+            alphas = np.full(n_alphas, np.finfo(float).resolution)
+        else:
+            alphas = np.logspace(np.log10(alpha_max * eps), np.log10(alpha_max), num=n_alphas)[::-1]
+        mse = np.zeros(n_alphas)
+        if len(folds) > 1:
+            for f in folds:
+                coefs, mean_t, y_mean, _ = path(folds[folds != f], alphas)
+                # squared residuals of the test fold from its Gram statistics, r = Z c + e - u with Z the shifted
+                # test data, e the intercept offset and u the centered test targets
+                test = stats.tests[f]
+                u = y[test] - y_mean
+                zu = X[test].T @ u - stats.shift * u.sum()
+                e = (stats.shift - mean_t) @ coefs
+                sc = stats.sums[f] @ coefs
+                mse += (np.sum(coefs * (stats.grams[f] @ coefs), axis=0) + 2 * e * sc + stats.counts[f] * e ** 2
+                        - 2 * zu @ coefs - 2 * e * u.sum() + u @ u) / stats.counts[f]
+        coefs, _, _, _ = path(folds, [alphas[np.argmin(mse)]])
+        return coefs[:, 0]
+
+
+class InteractionScreener(BaseEstimator, TransformerMixin):
+    """
+    Bounded replacement of PolynomialFeatures(degree=2, interaction_only=1). The pairwise products of the columns
+    are screened one column at a time by the absolute correlation of each product with the residual of a linear fit
+    of y on X, and only the max_interactions best pairs are generated, so the output holds 1 + k + max_interactions
+    columns instead of about k^2 / 2. When all pairs fit, the output equals that of PolynomialFeatures.
+    powers_ holds the exponents of the input columns for each output column, as in PolynomialFeatures.
+    """
+    def __init__(self, max_interactions=256):
+        self.max_interactions = max_interactions
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        n, k = X.shape
+        i, j = np.triu_indices(k, 1)
+        if i.shape[0] > self.max_interactions:
+            design = np.hstack([np.ones((n, 1)), X])
+            residual = y - design @ np.linalg.lstsq(design, y, rcond=None)[0]
+            residual = residual - residual.mean()
+            scores = np.empty(i.shape[0])
+            start = 0
+            for c in range(k - 1):
+                products = X[:, c:c + 1] * X[:, c + 1:]
+                products -= products.mean(axis=0)
+                norm = np.sqrt(np.sum(products ** 2, axis=0))
+                norm[norm == 0] = np.inf
+                scores[start:start + k - c - 1] = np.abs(residual @ products) / norm
+                start += k - c - 1
+            best = np.sort(np.argsort(-scores, kind='stable')[:self.max_interactions])
+            i, j = i[best], j[best]
+        self.pairs_ = np.column_stack([i, j])
+        self.n_input_features_ = k
+        self.powers_ = np.zeros((1 + k + i.shape[0], k), dtype=int)
+        self.powers_[1:k + 1] = np.eye(k, dtype=int)
+        self.powers_[1 + k + np.arange(i.shape[0]), i] = 1
+        self.powers_[1 + k + np.arange(i.shape[0]), j] = 1
+        return self
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        n, k = X.shape
+        result = np.empty((n, 1 + k + self.pairs_.shape[0]))
+        result[:, 0] = 1.
+        result[:, 1:k + 1] = X
+        np.multiply(X[:, self.pairs_[:, 0]], X[:, self.pairs_[:, 1]], out=result[:, k + 1:])
+        return result
+
 
 class LogMinPlus1_T(BaseEstimator, TransformerMixin):
     def __init__(self):
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vb_django', '0003_auto_20200810_1517'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='statistics',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vb_django', '0004_dataset_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modelresults',
+            name='name',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -65,6 +65,7 @@ class ModelData(models.Model):
 class ModelResults(models.Model):
     model_id = models.ForeignKey(AnalyticalModel, on_delete=models.CASCADE)
     dataset = models.CharField(max_length=32)   # dataset ID
+    name = models.CharField(max_length=32, null=True, blank=True)
     timestamp = models.DateTimeField()
     result = models.FloatField()
 
@@ -74,6 +75,7 @@ class Dataset(models.Model):
     name = models.CharField(max_length=32)
     description = models.CharField(max_length=128)
     data = models.BinaryField()
+    statistics = models.TextField(null=True, blank=True)      # serializable JSON, see DatasetStatistics.get
 
 
 class DatasetMetadata(models.Model):
@@ -3,6 +3,8 @@ from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 import vb_django.models as vb_models
 from vb_django.validation import Validator
+from vb_django.app.dataset_loader import DatasetLoader
+from vb_django.app.preprocessing import PPPlan
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -179,13 +181,13 @@ class ModelResultsSerializer(serializers.ModelSerializer):
     class Meta:
         model = vb_models.ModelResults
         fields = [
-            "model_id", "dataset_id", "timestamp", "result"
+            "model_id", "dataset_id", "name", "timestamp", "result"
         ]
 
 
 class DatasetSerializer(serializers.ModelSerializer):
     workflow_id = serializers.PrimaryKeyRelatedField(queryset=vb_models.Workflow.objects.all())
-    data = serializers.CharField()
+    data = serializers.CharField(trim_whitespace=False)
 
     def check_integrity(self, workflow):
         can_update = True
@@ -195,19 +197,26 @@ class DatasetSerializer(serializers.ModelSerializer):
                 can_update = False
         return can_update
 
+    def validate_data(self, value):
+        """
+        Parse the uploaded csv data, validated data is stored in the columnar format, see DatasetLoader.encode
+        """
+        try:
+            return DatasetLoader.encode(value)
+        except (ValueError, TypeError) as ex:
+            raise serializers.ValidationError("Invalid csv data: {}".format(ex))
+
     def create(self, validated_data):
-        if "data" in validated_data.keys():
-            validated_data["data"] = str(validated_data["data"]).encode()
         dataset = vb_models.Dataset(**validated_data)
         dataset.save()
         return dataset
 
     def update(self, instance, validated_data):
-        if "data" in validated_data.keys():
-            validated_data["data"] = str(validated_data["data"]).encode()
         dataset = vb_models.Dataset(**validated_data)
         if self.check_integrity(dataset.workflow_id):
             dataset.id = instance.id
+            DatasetLoader.invalidate(instance.id)
+            PPPlan.invalidate(instance.id)
         dataset.workflow_id = instance.workflow_id
         dataset.save()
         return dataset
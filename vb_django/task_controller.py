@@ -1,12 +1,18 @@
 import vb_django.dask_django
-from dask.distributed import Client, fire_and_forget
-from vb_django.models import Dataset, AnalyticalModel
-from io import StringIO
+from dask.distributed import Client, fire_and_forget, get_worker, worker_client
+from vb_django.models import Dataset, AnalyticalModel, PreProcessingConfig, ModelData, ModelResults
 from vb_django.app.linear_regression import LinearRegressionAutomatedVB
 from vb_django.app.metadata import Metadata
+from vb_django.app.dataset_loader import DatasetLoader
+from vb_django.app.preprocessing import PPGraph, PPDaskExecutor
+from vb_django.app.model_artifact import ModelArtifact
+from vb_django.app.flat_model import FlatLinearModel
 from dask import delayed
-import pickle
+from concurrent.futures import ThreadPoolExecutor
+from django.utils import timezone
+from django.db import transaction
 import pandas as pd
+import numpy as np
 import os
 import json
 import socket
@@ -19,7 +25,8 @@ logger.setLevel(logging.INFO)
 dask_scheduler = os.getenv("DASK_SCHEDULER", "tcp://" + socket.gethostbyname(socket.gethostname()) + ":8786")
 target = "Response"
 
-step_count = {"lra": 6}
+step_count = {"lra": 7}
+predict_workers = int(os.getenv("VB_PREDICT_WORKERS", os.cpu_count() or 1))
 
 
 class DaskTasks:
@@ -33,32 +40,170 @@ class DaskTasks:
         amodel.save()
 
         client = Client(dask_scheduler)
-        df = pd.read_csv(StringIO(bytes(dataset.data).decode())).drop("ID", axis=1)
-        # add preprocessing to task
-        fire_and_forget(client.submit(DaskTasks.execute_task, df, int(amodel.id), str(amodel.name), int(dataset_id)))
-        #DaskTasks.execute_task(df, int(amodel.id), str(amodel.name), int(dataset_id))
+        df = DatasetLoader.load(dataset).drop("ID", axis=1)
+        prepro_id = int(prepro_id) if prepro_id is not None else None
+        fire_and_forget(client.submit(
+            DaskTasks.execute_task, df, int(amodel.id), str(amodel.name), int(dataset_id), prepro_id
+        ))
+        #DaskTasks.execute_task(df, int(amodel.id), str(amodel.name), int(dataset_id), prepro_id)
 
     @staticmethod
-    def execute_task(df, model_id, model_name, dataset_id):
+    def execute_task(df, model_id, model_name, dataset_id, prepro_id=None):
         logger.info("Starting VB task -------- Model ID: {}; Model Type: {}; step 1/{}".format(model_id, model_name, step_count[model_name]))
         DaskTasks.update_status(model_id, "Loading and validating data", "1/{}".format(step_count[model_name]))
 
-        dataset_m = Metadata(parent=Dataset.objects.get(id=dataset_id)).get_metadata("DatasetMetadata")
+        dataset = Dataset.objects.get(id=dataset_id)
+        dataset_m = Metadata(parent=dataset).get_metadata("DatasetMetadata")
         target = "Response" if "response" not in dataset_m.keys() else dataset_m["response"]
         attributes = None if "attributes" not in dataset_m.keys() else dataset_m["attributes"]
+
+        logger.info("Model ID: {}, pre-processing step 2/{}".format(model_id, step_count[model_name]))
+        DaskTasks.update_status(model_id, "Pre-processing data", "2/{}".format(step_count[model_name]))
+        features, preprocessing = None, None
+        if prepro_id is not None:
+            try:
+                features, preprocessing = DaskTasks.execute_preprocessing(model_id, dataset, prepro_id, df)
+            except Exception as ex:
+                logger.warning("Model ID: {}, Error pre-processing data. step 2/{}. Error: {}".format(
+                    model_id, step_count[model_name], ex))
+                DaskTasks.update_status(
+                    model_id,
+                    "Failed to complete",
+                    "-1/{}".format(step_count[model_name]), "Error executing the pre-processing configuration"
+                )
+                return
+            df = pd.concat([df, features], axis=1)
         y = df[target]
         if attributes:
             attributes_list = json.loads(attributes.replace("\'", "\""))
+            if features is not None:
+                attributes_list.extend([c for c in features.columns if c not in attributes_list])
             x = df[attributes_list]
         else:
             x = df.drop(target, axis=1)
 
-        logger.info("Model ID: {}, loading hyper-parameters step 2/{}".format(model_id, step_count[model_name]))
-        DaskTasks.update_status(model_id, "Loading hyper-parameters", "2/{}".format(step_count[model_name]))
+        logger.info("Model ID: {}, loading hyper-parameters step 3/{}".format(model_id, step_count[model_name]))
+        DaskTasks.update_status(model_id, "Loading hyper-parameters", "3/{}".format(step_count[model_name]))
         parameters = Metadata(parent=AnalyticalModel.objects.get(id=model_id)).get_metadata("ModelMetadata")
 
         if model_name == "lra":
-            DaskTasks.execute_lra(model_id, parameters, x, y, step_count[model_name])
+            DaskTasks.execute_lra(model_id, parameters, x, y, step_count[model_name], preprocessing)
+
+    @staticmethod
+    def on_worker():
+        """
+        :return: True when called from a task running on a Dask worker
+        """
+        try:
+            get_worker()
+        except ValueError:
+            return False
+        return True
+
+    @staticmethod
+    def execute_preprocessing(model_id, dataset, prepro_id, df):
+        """
+        Execute a pre-processing configuration on the task data. The derived features of the model are persisted with
+        the fitted model, see execute_lra, as a ModelData entry named 'preprocessing' storing the features in the
+        columnar format with the configuration and its reductions over the task data, which are applied again to the
+        data of predictions.
+        :param model_id: AnalyticalModel id
+        :param dataset: Dataset model instance
+        :param prepro_id: PreProcessingConfig id
+        :param df: Task data
+        :return: DataFrame of the derived feature columns, and the fields of the 'preprocessing' ModelData entry
+        """
+        config = PreProcessingConfig.objects.get(id=int(prepro_id)).config
+        cache_key = (dataset.id, DatasetLoader.content_hash(dataset.data))
+        graph = PPGraph(None, json.loads(config))
+        if len(dataset.data) > PPDaskExecutor.min_size and DaskTasks.on_worker():
+            # large datasets are pre-processed over the partitions of the stored dataset across the Dask cluster, the
+            # task secedes from the worker thread pool while waiting for them
+            with worker_client():
+                ddf = DatasetLoader.partitions(dataset.data, columns=graph.plan.source_columns)
+                reductions = graph.reductions(ddf)
+                result = graph.distribute(ddf, reductions=reductions).compute()
+            result.index = df.index
+        else:
+            reductions = graph.reductions(df)
+            result = graph.execute(df, cache_key=cache_key, reductions=reductions)
+        features = result[[c for c in result.columns if c not in df.columns]]
+        preprocessing = {
+            "dataset": str(dataset.id),
+            "name": "preprocessing",
+            "data": DatasetLoader.encode(
+                features, metadata={"preprocessing": config, "reductions": json.dumps(reductions)}
+            ),
+            "comments": "Derived features of pre-processing configuration {}".format(prepro_id)
+        }
+        return features, preprocessing
+
+    @staticmethod
+    def load_preprocessing(amodel, decode=True):
+        """
+        :param amodel: AnalyticalModel model instance
+        :param decode: Decode the persisted derived features, otherwise only the names of their columns are read
+        :return: Pre-processing configuration, DataFrame of the persisted derived features or list of their names, and
+        reductions of the training data of the model, or None
+        """
+        model_data = ModelData.objects.filter(model_id=amodel, name="preprocessing").first()
+        if model_data is None:
+            return None, None, None
+        data = bytes(model_data.data)
+        metadata = DatasetLoader.metadata(data)
+        config = json.loads(metadata["preprocessing"])
+        reductions = json.loads(metadata["reductions"])
+        return config, DatasetLoader.decode(data) if decode else DatasetLoader.columns(data), reductions
+
+    @staticmethod
+    def save_evaluation(amodel, t):
+        """
+        Score the fitted model of a task and persist its test set predictions and residuals, as a ModelData entry named
+        'evaluation' in the columnar format, and its train and test scores as ModelResults entries.
+        :param amodel: AnalyticalModel model instance
+        :param t: LinearRegressionAutomatedVB with a fitted pipeline
+        """
+        # the evaluation of a previous fit is removed first, so a failed evaluation is not served for the new model
+        ModelData.objects.filter(model_id=amodel, name="evaluation").delete()
+        ModelResults.objects.filter(model_id=amodel, name__in=["train_score", "test_score"]).delete()
+        results = t.lr_estimator.predict(t.x_test)
+        residuals = t.y_test.to_numpy().flatten() - results
+        scores = {
+            "train_score": t.lr_estimator.score(t.x_train, t.y_train),
+            "test_score": t.lr_estimator.score(t.x_test, t.y_test)
+        }
+        ModelData.objects.create(
+            model_id=amodel,
+            dataset=str(amodel.dataset),
+            name="evaluation",
+            data=DatasetLoader.encode(pd.DataFrame({"results": results, "residuals": residuals})),
+            comments="Test set predictions and residuals of the fitted model"
+        )
+        timestamp = timezone.now()
+        for name, score in scores.items():
+            ModelResults.objects.create(
+                model_id=amodel, dataset=str(amodel.dataset), name=name, timestamp=timestamp, result=float(score)
+            )
+
+    @staticmethod
+    def load_evaluation(amodel):
+        """
+        :param amodel: AnalyticalModel model instance
+        :return: Dictionary of the persisted test set results and residuals and train and test scores of the model, or
+        None for models fitted before evaluations were persisted
+        """
+        model_data = ModelData.objects.filter(model_id=amodel, name="evaluation").first()
+        results = ModelResults.objects.filter(model_id=amodel, name__in=["train_score", "test_score"])
+        scores = {r.name: r.result for r in results}
+        if model_data is None or len(scores) < 2:
+            return None
+        evaluation = DatasetLoader.decode(bytes(model_data.data))
+        return {
+            "results": evaluation["results"].to_numpy(),
+            "train_score": scores["train_score"],
+            "residuals": evaluation["residuals"].to_numpy(),
+            "test_score": scores["test_score"]
+        }
 
     @staticmethod
     def update_status(_id, status, stage, message=None, retry=5):
@@ -75,17 +220,37 @@ class DaskTasks:
 
     @staticmethod
     def make_prediction(amodel_id, data=None):
+        """
+        Test set results of a fitted model, or its predictions for posted data. The persisted evaluation of the model
+        is served without loading the model, models fitted before evaluations were persisted are scored again.
+        :param amodel_id: AnalyticalModel id
+        :param data: Optional DataFrame of new data to predict
+        :return: Dictionary of results and train_score, and of residuals and test_score for the test set
+        """
         amodel = AnalyticalModel.objects.get(id=int(amodel_id))
+        evaluation = DaskTasks.load_evaluation(amodel)
+        if evaluation is not None:
+            if data is None:
+                return evaluation
+            return {
+                "results": DaskTasks.predict(DaskTasks.load_predictor(amodel), data),
+                "train_score": evaluation["train_score"]
+            }
         dataset = Dataset.objects.get(id=int(amodel.dataset))
         y_data = None
 
-        df = pd.read_csv(StringIO(bytes(dataset.data).decode()))
+        df = DatasetLoader.load(dataset).drop("ID", axis=1)
         dataset_m = Metadata(parent=dataset).get_metadata("DatasetMetadata")
         target = "Response" if "response" not in dataset_m.keys() else dataset_m["response"]
         attributes = None if "attributes" not in dataset_m.keys() else dataset_m["attributes"]
+        pp_config, features, reductions = DaskTasks.load_preprocessing(amodel)
+        if features is not None:
+            df = pd.concat([df, features], axis=1)
         y = df[target]
         if attributes:
             attributes_list = json.loads(attributes.replace("\'", "\""))
+            if features is not None:
+                attributes_list.extend([c for c in features.columns if c not in attributes_list])
             x = df[attributes_list]
         else:
             x = df.drop(target, axis=1)
@@ -99,7 +264,9 @@ class DaskTasks:
 
         if data is not None:
             x_data = data
-        model = pickle.loads(amodel.model)
+            if pp_config is not None:
+                x_data = PPGraph(data, pp_config, outputs=list(features.columns), reductions=reductions).data
+        model = ModelArtifact.load_predictor(amodel)
         response = {
             "results": model.predict(x_data),
             "train_score": model.score(x_train, y_train)
@@ -110,55 +277,152 @@ class DaskTasks:
         return response
 
     @staticmethod
-    def execute_lra(model_id, parameters, x, y, step_count):
-        DaskTasks.update_status(model_id, "Initializing automated linear regressor", "3/{}".format(step_count))
-        logger.info("Model ID: {}, Initializing automated linear regressor. step 3/{}".format(model_id, step_count))
+    def load_predictor(amodel):
+        """
+        :param amodel: AnalyticalModel model instance with a fitted model
+        :return: Cached predictor of the model, and its pre-processing configuration, derived feature names and
+        training reductions or None
+        """
+        pp_config, outputs, reductions = DaskTasks.load_preprocessing(amodel, decode=False)
+        return ModelArtifact.load_predictor(amodel), pp_config, outputs, reductions
+
+    @staticmethod
+    def predict(predictor, data):
+        """
+        :param predictor: Predictor and pre-processing of the model returned by load_predictor
+        :param data: DataFrame of new data
+        :return: 1-D array of the predictions of the model for data, independent of the other rows of data
+        """
+        model, pp_config, outputs, reductions = predictor
+        if pp_config is not None:
+            data = PPGraph(data, pp_config, outputs=outputs, reductions=reductions).data
+        return model.predict(data)
+
+    @staticmethod
+    def predict_batch(batch, workers=None):
+        """
+        Predictions of many fitted models for many rows. Each model is loaded once, from the per process model cache,
+        and the predictions run concurrently in a thread pool.
+        :param batch: List of (AnalyticalModel model instance, DataFrame) pairs
+        :param workers: Number of threads, defaults to VB_PREDICT_WORKERS
+        :return: Columnar dictionary of the model_id, row and prediction arrays, and dictionary of error messages by
+        model id for the models that failed
+        """
+        predictors, errors = {}, {}
+        for amodel, _ in batch:
+            if amodel.id in predictors or amodel.id in errors:
+                continue
+            try:
+                predictors[amodel.id] = DaskTasks.load_predictor(amodel)
+            except Exception as ex:
+                logger.warning("Model ID: {}, Error loading the model for predictions: {}".format(amodel.id, ex))
+                errors[amodel.id] = "Error loading the fitted model"
+        jobs = [(amodel.id, data) for amodel, data in batch if amodel.id in predictors]
+        with ThreadPoolExecutor(max_workers=workers or predict_workers) as pool:
+            futures = [pool.submit(DaskTasks.predict, predictors[model_id], data) for model_id, data in jobs]
+        model_ids, rows, predictions = [], [], []
+        for (model_id, _), future in zip(jobs, futures):
+            try:
+                result = np.asarray(future.result(), dtype=np.float64).ravel()
+            except Exception as ex:
+                errors[model_id] = "Error predicting data: {}".format(ex)
+                continue
+            model_ids.append(np.full(result.shape[0], model_id, dtype=np.int64))
+            rows.append(np.arange(result.shape[0], dtype=np.int64))
+            predictions.append(result)
+        columns = {
+            "model_id": np.concatenate(model_ids) if model_ids else np.empty(0, dtype=np.int64),
+            "row": np.concatenate(rows) if rows else np.empty(0, dtype=np.int64),
+            "prediction": np.concatenate(predictions) if predictions else np.empty(0)
+        }
+        return columns, errors
+
+    @staticmethod
+    def execute_lra(model_id, parameters, x, y, step_count, preprocessing=None):
+        """
+        Fit the automated linear regressor and save the fitted model. The 'preprocessing' ModelData entry of the model
+        is replaced in the same transaction, and removed for models fitted without pre-processing, so a model is never
+        paired with derived features it was not trained on.
+        :param model_id: AnalyticalModel id
+        :param parameters: Hyper-parameters of the model
+        :param x: DataFrame of the input columns
+        :param y: Response column
+        :param step_count: Number of steps of the task
+        :param preprocessing: Fields of the 'preprocessing' ModelData entry returned by execute_preprocessing, or None
+        """
+        DaskTasks.update_status(model_id, "Initializing automated linear regressor", "4/{}".format(step_count))
+        logger.info("Model ID: {}, Initializing automated linear regressor. step 4/{}".format(model_id, step_count))
         t = LinearRegressionAutomatedVB()
-        t.validate_h_params(parameters)
+        try:
+            t.validate_h_params(parameters)
+        except Exception as ex:
+            logger.warning("Model ID: {}, Invalid hyper-parameters. step 4/{}. Error: {}".format(
+                model_id, step_count, ex))
+            DaskTasks.update_status(
+                model_id,
+                "Failed to complete",
+                "-1/{}".format(step_count), "Invalid hyper-parameters: {}".format(ex)
+            )
+            return
         try:
             t.set_data(x, y)
         except Exception as ex:
-            logger.warning("Model ID: {}, Error setting data. step 3/{}. Error: {}".format(model_id, step_count, ex))
+            logger.warning("Model ID: {}, Error setting data. step 4/{}. Error: {}".format(model_id, step_count, ex))
             DaskTasks.update_status(
                 model_id,
                 "Failed to complete",
                 "-1/{}".format(step_count), "Error setting data. Issue with input data"
             )
             return
-        logger.info("Model ID: {}, Constructing pipeline. step 4/{}".format(model_id, step_count))
-        DaskTasks.update_status(model_id, "Constructing pipeline", "4/{}".format(step_count))
+        logger.info("Model ID: {}, Constructing pipeline. step 5/{}".format(model_id, step_count))
+        DaskTasks.update_status(model_id, "Constructing pipeline", "5/{}".format(step_count))
         try:
             t.set_pipeline()
         except Exception as ex:
-            logger.warning("Model ID: {}, Error setting data. step 4/{}. Error: {}".format(model_id, step_count, ex))
+            logger.warning("Model ID: {}, Error setting data. step 5/{}. Error: {}".format(model_id, step_count, ex))
             DaskTasks.update_status(
                 model_id,
                 "Failed to complete",
                 "-1/{}".format(step_count), "Error setting the pipeline."
             )
             return
-        logger.info("Model ID: {}, Saving fitted model. step 5/{}".format(model_id, step_count))
-        DaskTasks.update_status(model_id, "Saving fitted model", "5/{}".format(step_count))
+        logger.info("Model ID: {}, Saving fitted model. step 6/{}".format(model_id, step_count))
+        DaskTasks.update_status(model_id, "Saving fitted model", "6/{}".format(step_count))
 
+        metadata = {"hyperparameters": t.hyperparameters}
+        try:
+            metadata["flat"] = FlatLinearModel.export(t.lr_estimator, list(t.x_train.columns)).to_dict()
+        except ValueError as ex:
+            logger.info("Model ID: {}, the fitted pipeline can not be flattened: {}".format(model_id, ex))
         saved = False
         save_tries = 0
         err = None
         while not saved and save_tries < 5:
             try:
-                amodel = AnalyticalModel.objects.get(id=model_id)
-                amodel.model = pickle.dumps(t.lr_estimator)
-                amodel.save()
+                with transaction.atomic():
+                    amodel = AnalyticalModel.objects.get(id=model_id)
+                    amodel.model = ModelArtifact.dumps(t.lr_estimator, metadata=metadata)
+                    amodel.save()
+                    ModelData.objects.filter(model_id=amodel, name="preprocessing").delete()
+                    if preprocessing is not None:
+                        ModelData.objects.create(model_id=amodel, **preprocessing)
+                ModelArtifact.invalidate(model_id)
                 saved = True
             except Exception as ex:
-                logger.warning("Error attempting to save pickled model: {}".format(ex))
+                logger.warning("Error attempting to save the fitted model: {}".format(ex))
                 err = ex
                 time.sleep(.5)
                 save_tries += 1
         if saved:
-            logger.info("Model ID: {}, Completed. step 6/{}".format(model_id, step_count))
-            DaskTasks.update_status(model_id, "Complete", "6/{}".format(step_count))
+            try:
+                DaskTasks.save_evaluation(amodel, t)
+            except Exception as ex:
+                # predictions of the model do not depend on it, make_prediction scores models without an evaluation
+                logger.warning("Model ID: {}, Error saving the model evaluation: {}".format(model_id, ex))
+            logger.info("Model ID: {}, Completed. step 7/{}".format(model_id, step_count))
+            DaskTasks.update_status(model_id, "Complete", "7/{}".format(step_count))
         else:
-            logger.warning("Model ID: {}, Error pickling model. step 5/{}. Error: {}".format(model_id, step_count, err))
+            logger.warning("Model ID: {}, Error saving model. step 6/{}. Error: {}".format(model_id, step_count, err))
             DaskTasks.update_status(
                 model_id,
                 "Failed to complete",
@@ -0,0 +1,67 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LinearRegression
+from vb_django.models import Location, Workflow, AnalyticalModel, ModelData
+from vb_django.app.dataset_loader import DatasetLoader
+from vb_django.app.model_artifact import ModelArtifact
+from vb_django.app.flat_model import FlatLinearModel
+from vb_django.app.preprocessing import PPGraph
+from vb_django.task_controller import DaskTasks
+import numpy as np
+import pandas as pd
+import json
+
+
+class BatchPredictionTest(TestCase):
+    """
+    Predictions of a model whose pre-processing normalizes a column over all rows do not depend on the other rows
+    predicted with it.
+    """
+    def setUp(self):
+        user = User.objects.create(username="batch")
+        location = Location.objects.create(owner_id=user, name="location", description="", start_latitude=0,
+                                           start_longitude=0, end_latitude=0, end_longitude=0, o_latitude=0,
+                                           o_longitude=0)
+        workflow = Workflow.objects.create(location_id=location, name="workflow", description="")
+        rng = np.random.RandomState(42)
+        self.data = pd.DataFrame(rng.uniform(1, 2, size=(100, 2)), columns=["x1", "x2"])
+        config = {"nodes": {"1": {"function": "normalize", "args": {"c": "x2"}}}, "edges": []}
+        graph = PPGraph(None, config)
+        reductions = graph.reductions(self.data)
+        x = graph.execute(self.data, reductions=reductions)
+        features = x[[c for c in x.columns if c not in self.data.columns]]
+        model = make_pipeline(StandardScaler(), LinearRegression()).fit(x, x["x1"] + 100 * features.iloc[:, 0])
+        self.amodel = AnalyticalModel.objects.create(workflow_id=workflow, name="lra", description="",
+                                                     model=ModelArtifact.dumps(model))
+        ModelData.objects.create(
+            model_id=self.amodel, dataset="0", name="preprocessing", comments="",
+            data=DatasetLoader.encode(features, metadata={"preprocessing": json.dumps(config),
+                                                          "reductions": json.dumps(reductions)})
+        )
+
+    def test_row_prediction_independent_of_batch(self):
+        rows = self.data.iloc[:10]
+        predictor = DaskTasks.load_predictor(self.amodel)
+        alone = np.array([DaskTasks.predict(predictor, rows.iloc[[i]])[0] for i in range(rows.shape[0])])
+        columns, errors = DaskTasks.predict_batch(
+            [(self.amodel, rows), (self.amodel, rows.iloc[:3]), (self.amodel, rows.iloc[3:])]
+        )
+        self.assertEqual(errors, {})
+        np.testing.assert_allclose(columns["prediction"][:10], alone, rtol=1e-12)
+        np.testing.assert_allclose(columns["prediction"][10:], alone, rtol=1e-12)
+
+
+class FlatLinearModelTest(TestCase):
+    """
+    Predictions of an exported pipeline equal those of the pipeline, its columns are selected by name.
+    """
+    def test_predict_ignores_extra_columns(self):
+        rng = np.random.RandomState(42)
+        x = pd.DataFrame(rng.uniform(1, 2, size=(50, 3)), columns=["x1", "x2", "x3"])
+        y = x @ np.array([1., 2., 3.])
+        model = make_pipeline(StandardScaler(), LinearRegression()).fit(x, y)
+        flat = FlatLinearModel.export(model, list(x.columns))
+        data = x[["x3", "x1", "x2"]].assign(site=["site-{}".format(i) for i in range(x.shape[0])])
+        np.testing.assert_allclose(flat.predict(data), model.predict(x), rtol=1e-12)
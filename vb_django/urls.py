@@ -28,7 +28,7 @@ from vb_django.views.workflow_views import WorkflowView
 from vb_django.views.analytical_model_views import AnalyticalModelView
 from vb_django.views.dataset_views import DatasetView
 from vb_django.views.preprocessing_views import PreProcessingConfigView
-from vb_django.views.utilities_views import analytical_model_details
+from vb_django.views.utilities_views import analytical_model_details, cache_details
 
 
 router = routers.SimpleRouter()
@@ -78,6 +78,7 @@ urlpatterns = [
     path('api/', include(router.urls)),
 
     path('info/analyticalmodels/', analytical_model_details),
+    path('info/caches/', cache_details),
 
 ]
 
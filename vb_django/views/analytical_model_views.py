@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import TokenAuthentication
 from vb_django.models import AnalyticalModel
 from vb_django.app.metadata import Metadata
+from vb_django.app.model_artifact import ModelArtifact
 from vb_django.serializers import AnalyticalModelSerializer
 from vb_django.permissions import IsOwnerOfWorkflowChild
 
@@ -64,6 +65,7 @@ class AnalyticalModelView(viewsets.ViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             if IsOwnerOfWorkflowChild().has_object_permission(request, self, original_amodel):
+                ModelArtifact.invalidate(original_amodel.id)
                 amodel = serializer.update(original_amodel, serializer.validated_data)
                 if amodel:
                     response_status = status.HTTP_201_CREATED
@@ -88,6 +90,7 @@ class AnalyticalModelView(viewsets.ViewSet):
             except AnalyticalModel.DoesNotExist:
                 return Response("No analytical model found for id: {}".format(pk), status=status.HTTP_400_BAD_REQUEST)
             if IsOwnerOfWorkflowChild().has_object_permission(request, self, amodel):
+                ModelArtifact.invalidate(amodel.id)
                 amodel.delete()
                 return Response(status=status.HTTP_200_OK)
             else:
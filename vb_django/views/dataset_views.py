@@ -7,8 +7,8 @@ from vb_django.serializers import DatasetSerializer
 from vb_django.permissions import IsOwnerOfWorkflowChild
 from vb_django.app.metadata import Metadata
 from vb_django.app.statistics import DatasetStatistics
-from io import StringIO
-import pandas as pd
+from vb_django.app.dataset_loader import DatasetLoader
+from vb_django.app.preprocessing import PPPlan
 
 
 class DatasetView(viewsets.ViewSet):
@@ -53,10 +53,10 @@ class DatasetView(viewsets.ViewSet):
             if meta:
                 response_data["metadata"] = meta
                 response = meta["response"]
-            response_data["data"] = pd.read_csv(StringIO(bytes(dataset.data).decode()))
+            response_data["data"] = DatasetLoader.load(dataset)
             if response not in response_data["data"]:
                 response = response_data["data"].columns.tolist()[0]
-            response_data["statistics"] = DatasetStatistics(response_data["data"]).calculate_statistics(response)
+            response_data["statistics"] = DatasetStatistics.get(dataset, response, response_data["data"])
             return Response(response_data, status=status.HTTP_200_OK)
         else:
             return Response(
@@ -85,10 +85,10 @@ class DatasetView(viewsets.ViewSet):
                 if meta:
                     dataset["metadata"] = meta
                     response = meta["response"]
-                data = pd.read_csv(StringIO(bytes(d.data).decode()))
-                if response not in data:
-                    response = data.columns.tolist()[0]
-                dataset["statistics"] = DatasetStatistics(data).calculate_statistics(response)
+                columns = DatasetLoader.columns(d.data)
+                if response not in columns:
+                    response = columns[0]
+                dataset["statistics"] = DatasetStatistics.get(d, response)
                 del dataset["data"]
                 return Response(dataset, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -113,8 +113,14 @@ class DatasetView(viewsets.ViewSet):
                     response_data = serializer.data
                     response_data["id"] = amodel.id
                     del response_data["data"]
+                    response = "Response"
                     if meta:
                         response_data["metadata"] = meta
+                        response = meta["response"]
+                    columns = DatasetLoader.columns(amodel.data)
+                    if response not in columns:
+                        response = columns[0]
+                    response_data["statistics"] = DatasetStatistics.get(amodel, response)
                     if int(pk) == amodel.id:
                         response_status = status.HTTP_200_OK
                     return Response(response_data, status=response_status)
@@ -131,6 +137,8 @@ class DatasetView(viewsets.ViewSet):
             if IsOwnerOfWorkflowChild().has_object_permission(request, self, dataset):
                 m = Metadata(dataset)
                 m.delete_metadata("DatasetMetadata")
+                DatasetLoader.invalidate(dataset.id)
+                PPPlan.invalidate(dataset.id)
                 dataset.delete()
                 return Response(status=status.HTTP_200_OK)
             else:
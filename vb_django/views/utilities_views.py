@@ -1,4 +1,6 @@
 from vb_django.app.linear_regression import LinearRegressionAutomatedVB
+from vb_django.app.dataset_loader import DatasetLoader
+from vb_django.app.model_artifact import ModelArtifact
 from django.http import HttpResponse, JsonResponse
 
 
@@ -13,3 +15,14 @@ def analytical_model_details(request):
     details.append(lra.get_info())
 
     return JsonResponse(details, safe=False)
+
+
+def cache_details(request):
+    """
+    Returns the size and hit/miss/eviction counters of the per process dataset and model caches of this server process
+    """
+    details = {
+        "datasets": DatasetLoader.cache_info(),
+        "models": ModelArtifact.cache_info()
+    }
+    return JsonResponse(details)
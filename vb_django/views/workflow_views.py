@@ -6,10 +6,12 @@ from rest_framework.decorators import action
 from vb_django.models import Workflow, Dataset, PreProcessingConfig, AnalyticalModel
 from vb_django.serializers import WorkflowSerializer
 from vb_django.permissions import IsOwnerOfLocationChild
-from vb_django.app.preprocessing import PPGraph
+from vb_django.app.preprocessing import PPGraph, PPStreamExecutor
 from vb_django.task_controller import DaskTasks
 from vb_django.app.metadata import Metadata
+from vb_django.app.dataset_loader import DatasetLoader
 from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse
 from io import StringIO
 import pandas as pd
 import json
@@ -106,9 +108,10 @@ class WorkflowView(viewsets.ViewSet):
     def run_preprocessing(self, request, pk=None):
         """
         Execute a preprocessing configuration on a specified dataset.
-        :param request: GET request containing two parameters dataset_id and preprocessing_id
+        :param request: GET request containing two parameters dataset_id and preprocessing_id, and optionally the
+        requested output columns as one or more 'outputs' parameters
         :param pk: id of the workflow
-        :return: complete pre-processing transformation of the dataset
+        :return: complete pre-processing transformation of the dataset, or the requested output columns
         """
         if "dataset_id" in self.request.query_params.keys():
             try:
@@ -127,13 +130,24 @@ class WorkflowView(viewsets.ViewSet):
                             int(self.request.query_params.get('preprocessing_id'))),
                         status=status.HTTP_400_BAD_REQUEST
                     )
-                raw_data = pd.read_csv(StringIO(dataset.data.decode()))
                 pp_configuration = json.loads(preprocess_config.config)
-                result_string = StringIO()
-                result = PPGraph(raw_data, pp_configuration).data
-                result_columns = set.difference(set(result.columns), set(raw_data.columns))
-                result = result[result_columns]
-                result.to_csv(result_string)
+                outputs = self.request.query_params.getlist('outputs') or None
+                pp_graph = PPGraph(None, pp_configuration, outputs=outputs)
+                if outputs is not None:
+                    unknown = pp_graph.compile(fuse=False).unknown(outputs, DatasetLoader.columns(dataset.data))
+                    if unknown:
+                        return Response("Unknown output columns: {}".format(", ".join(unknown)),
+                                        status=status.HTTP_400_BAD_REQUEST)
+                try:
+                    if len(dataset.data) > PPStreamExecutor.min_size:
+                        result = pp_graph.execute_chunks(lambda: DatasetLoader.iter_chunks(dataset.data))
+                    else:
+                        raw_data = DatasetLoader.load(dataset, columns=pp_graph.plan.source_columns)
+                        cache_key = (dataset.id, DatasetLoader.content_hash(dataset.data))
+                        result = pp_graph.execute(raw_data, cache_key=cache_key)
+                except KeyError as ex:
+                    return Response("Dataset column not found: {}".format(ex), status=status.HTTP_400_BAD_REQUEST)
+                result = result[[c for c in result.columns if c not in pp_graph.plan.source_columns]]
                 response_result = {"processed_data": result}
                 return Response(response_result, status=status.HTTP_200_OK)
             else:
@@ -143,6 +157,12 @@ class WorkflowView(viewsets.ViewSet):
 
     @action(detail=False, methods=["post"], name="Execute technique for specified dataset, analytical model and preprocessing")
     def execute(self, request):
+        """
+        Execute an analytical model on a dataset as a Dask task.
+        :param request: POST request containing workflow_id, dataset_id and model_id, and optionally preprocessing_id
+        of a pre-processing configuration executed in the task, adding its derived features to the model inputs
+        :return: Task submission message
+        """
         input_data = request.data.dict()
         required_parameters = ["workflow_id", "dataset_id", "model_id"]
         if set(required_parameters).issubset(input_data.keys()):
@@ -158,7 +178,14 @@ class WorkflowView(viewsets.ViewSet):
                 dataset = Dataset.objects.get(id=int(input_data["dataset_id"]))
             except ObjectDoesNotExist:
                 dataset = None
-            if workflow is None or dataset is None or amodel is None:
+            prepro_id = input_data.get("preprocessing_id") or None
+            preprocess_config = None
+            if prepro_id is not None:
+                try:
+                    preprocess_config = PreProcessingConfig.objects.get(id=int(prepro_id))
+                except ObjectDoesNotExist:
+                    preprocess_config = None
+            if workflow is None or dataset is None or amodel is None or (prepro_id and preprocess_config is None):
                 message = []
                 if workflow is None:
                     message.append("No workflow found for id: {}".format(input_data["workflow_id"]))
@@ -166,10 +193,16 @@ class WorkflowView(viewsets.ViewSet):
                     message.append("No dataset found for id: {}".format(input_data["dataset_id"]))
                 if amodel is None:
                     message.append("No analytical model found for id: {}".format(input_data["model_id"]))
+                if prepro_id and preprocess_config is None:
+                    message.append("No preprocessing configuration found for id: {}".format(prepro_id))
                 return Response(", ".join(message), status=status.HTTP_400_BAD_REQUEST)
             elif IsOwnerOfLocationChild().has_object_permission(request, self, workflow):
                 try:
-                    DaskTasks.setup_task(dataset_id=dataset.id, amodel_id=amodel.id)
+                    DaskTasks.setup_task(
+                        dataset_id=dataset.id,
+                        amodel_id=amodel.id,
+                        prepro_id=preprocess_config.id if preprocess_config else None
+                    )
                     response = "Successfully executed analytical model"
                 except Exception as ex:
                     response = "Error occured attempting to execute analytical model. Message: {}".format(ex)
@@ -223,3 +256,70 @@ class WorkflowView(viewsets.ViewSet):
         data = "Missing required parameters: {}".format(", ".join(required_parameters))
         response_status = status.HTTP_200_OK
         return Response(data, status=response_status)
+
+    @action(detail=False, methods=["POST"], name="Batch predictions of fitted analytical models.")
+    def predict(self, request):
+        """
+        Predictions of many fitted analytical models of a workflow in a single request.
+        :param request: POST request containing workflow_id and either 'models', a list of {"model_id", "data"} objects
+        with csv data for each model, or 'model_ids', a list of model ids, with csv 'data' or the 'dataset_id' of a
+        dataset predicted by every model. Lists can be posted as JSON strings. Optionally the response 'format',
+        'json' (default) or 'arrow'.
+        :return: Columnar predictions (model_id, row and prediction) and error messages by model id, as a JSON object
+        or as an Arrow IPC file with the errors in its schema metadata
+        """
+        inputs = request.data.dict() if hasattr(request.data, "dict") else dict(request.data)
+        if "workflow_id" not in inputs.keys() or not ({"models", "model_ids"} & set(inputs.keys())):
+            return Response(
+                "Missing required parameters in POST request. Required parameters: workflow_id, models or model_ids",
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            workflow = Workflow.objects.get(id=int(inputs["workflow_id"]))
+        except ObjectDoesNotExist:
+            return Response("No workflow found for id: {}".format(inputs["workflow_id"]),
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not IsOwnerOfLocationChild().has_object_permission(request, self, workflow):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+        def parse_list(value):
+            if isinstance(value, str):
+                value = json.loads(value) if value.strip().startswith("[") else value.split(",")
+            return list(value)
+        try:
+            if "models" in inputs.keys():
+                batch = [(int(m["model_id"]), pd.read_csv(StringIO(m["data"]))) for m in parse_list(inputs["models"])]
+            else:
+                model_ids = [int(m) for m in parse_list(inputs["model_ids"])]
+                if "data" in inputs.keys():
+                    data = pd.read_csv(StringIO(inputs["data"]))
+                elif "dataset_id" in inputs.keys():
+                    dataset = Dataset.objects.get(id=int(inputs["dataset_id"]), workflow_id=workflow.id)
+                    data = DatasetLoader.load(dataset)
+                    dataset_m = Metadata(parent=dataset).get_metadata("DatasetMetadata")
+                    target = "Response" if "response" not in dataset_m.keys() else dataset_m["response"]
+                    data = data.drop([c for c in ("ID", target) if c in data.columns], axis=1)
+                else:
+                    return Response("Missing 'data' or 'dataset_id' for the predictions of 'model_ids'",
+                                    status=status.HTTP_400_BAD_REQUEST)
+                batch = [(model_id, data) for model_id in model_ids]
+        except ObjectDoesNotExist:
+            return Response("No dataset found for id: {}".format(inputs["dataset_id"]),
+                            status=status.HTTP_400_BAD_REQUEST)
+        except (ValueError, KeyError, TypeError, pd.errors.ParserError) as ex:
+            return Response("Invalid batch prediction request: {}".format(ex), status=status.HTTP_400_BAD_REQUEST)
+
+        amodels = AnalyticalModel.objects.filter(id__in={m for m, _ in batch}, workflow_id=workflow.id)
+        amodels = {amodel.id: amodel for amodel in amodels if amodel.model}
+        errors = {m: "No fitted analytical model found for id: {}".format(m) for m, _ in batch if m not in amodels}
+        columns, prediction_errors = DaskTasks.predict_batch([(amodels[m], d) for m, d in batch if m in amodels])
+        errors.update(prediction_errors)
+        if inputs.get("format", "json") == "arrow":
+            data = DatasetLoader.encode(pd.DataFrame(columns), metadata={"errors": json.dumps(errors)})
+            return HttpResponse(data, content_type="application/vnd.apache.arrow.file")
+        response = {
+            "workflow_id": workflow.id,
+            "predictions": {k: v.tolist() for k, v in columns.items()},
+            "errors": errors
+        }
+        return Response(response, status=status.HTTP_200_OK)